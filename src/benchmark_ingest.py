@@ -0,0 +1,418 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 与DR10 LRS恒星星表相同的列名和FITS格式（只保留常用的列，行宽与真实星表相近）
+CATALOG_COLUMNS = [
+    ('obsid', 'K'), ('designation', '19A'), ('obsdate', '10A'), ('lmjd', 'J'), ('mjd', 'J'),
+    ('planid', '40A'), ('spid', 'I'), ('fiberid', 'I'), ('ra_obs', 'D'), ('dec_obs', 'D'),
+    ('snru', 'E'), ('snrg', 'E'), ('snrr', 'E'), ('snri', 'E'), ('snrz', 'E'),
+    ('class', '10A'), ('subclass', '10A'), ('z', 'E'), ('z_err', 'E'), ('ps_id', 'K'),
+    ('ra', 'D'), ('dec', 'D'), ('teff', 'E'), ('teff_err', 'E'), ('logg', 'E'), ('logg_err', 'E'),
+    ('feh', 'E'), ('feh_err', 'E'), ('rv', 'E'), ('rv_err', 'E'), ('gaia_source_id', 'K'),
+    ('gaia_g_mean_mag', 'E'), ('fibertype', '10A'),
+]
+
+# 子类型及其比例，(子类型, 比例, 有效温度均值, 有效温度标准差)
+SUBCLASSES = [
+    ('A1IV', 0.01, 9300, 300), ('A2IV', 0.01, 8900, 300), ('A7V', 0.02, 7900, 250),
+    ('F0', 0.06, 7200, 200), ('F5', 0.12, 6500, 150), ('F9', 0.12, 6100, 150),
+    ('G2', 0.14, 5750, 120), ('G5', 0.12, 5550, 120), ('G8', 0.10, 5300, 120),
+    ('K1', 0.10, 5000, 150), ('K3', 0.08, 4700, 150), ('K5', 0.06, 4400, 150),
+    ('M0', 0.04, 3900, 100), ('M2', 0.02, 3600, 100),
+]
+
+# 每块观测板的光纤数，同一块板上的目标在天区上相邻、obsid连续
+FIBERS_PER_PLATE = 4000
+
+# 基准测试的默认行数（可以一直加到2000万行）
+DEFAULT_ROWS = [100_000, 1_000_000]
+
+# 生成星表时每次写出的行数
+GENERATE_CHUNK_ROWS = 1_000_000
+
+INGEST_MODES = ('pandas', 'columnar', 'chunked', 'parallel')
+
+# 与基准结果比较时，耗时或内存超过基准的比例
+DEFAULT_TOLERANCE = 0.2
+
+# 与读取本身无关的簿记工作：缓存键要对星表做内容哈希，处理完后要重建obsid索引。
+# 对照方式没有这些工作，单独计时，不计入读取耗时
+BOOKKEEPING_CALLS = ('source_entry', 'record_ingested')
+
+# 匿名内存（RssAnon）的采样间隔（秒）
+ANON_SAMPLE_INTERVAL = 0.02
+
+def catalog_coldefs():
+    return fits.ColDefs([fits.Column(name=name, format=fmt) for name, fmt in CATALOG_COLUMNS])
+
+def synthetic_rows(start, n, seed=0):
+    """生成第[start, start+n)行的合成星表数据。每块只依赖行号和seed，分块生成的结果与一次生成相同"""
+    rng = np.random.default_rng([seed, start])
+    index = start + np.arange(n)
+    plate = index // FIBERS_PER_PLATE
+    # 观测板中心沿黄金角序列分布在LAMOST的天区范围内，同一块板上的目标在2.5度半径内
+    plate_ra = (plate * 137.50776) % 360
+    plate_dec = -10 + 70 * ((plate * 0.6180340) % 1)
+    radius = 2.5 * np.sqrt(rng.random(n))
+    angle = rng.random(n) * 2 * np.pi
+    dec = np.clip(plate_dec + radius * np.sin(angle), -90, 90)
+    ra = (plate_ra + radius * np.cos(angle) / np.cos(np.radians(dec))) % 360
+
+    names, probs, teff_mean, teff_std = zip(*SUBCLASSES)
+    kind = rng.choice(len(SUBCLASSES), size=n, p=np.array(probs) / sum(probs))
+    teff = rng.normal(np.array(teff_mean)[kind], np.array(teff_std)[kind])
+    giant = rng.random(n) < 0.2
+    logg = np.where(giant, rng.normal(2.5, 0.4, n), rng.normal(4.3, 0.2, n))
+    feh = rng.normal(-0.2, 0.3, n)
+    snrg = rng.lognormal(np.log(30), 0.9, n)
+    rv = rng.normal(0, 40, n)
+
+    # FITS二进制表按大端字节序存储
+    data = np.zeros(n, dtype=catalog_coldefs().dtype.newbyteorder('>'))
+    data['obsid'] = 100_000_000 + index * 2 + rng.integers(0, 2, n)
+    data['designation'] = np.char.add('J', np.char.mod('%017d', index))
+    data['obsdate'] = '2020-01-01'
+    data['lmjd'] = 58850 + plate // 10
+    data['mjd'] = data['lmjd'] - 1
+    data['planid'] = np.char.add('PLATE', plate.astype(str))
+    data['spid'] = (index % FIBERS_PER_PLATE) // 250 + 1
+    data['fiberid'] = index % 250 + 1
+    data['ra_obs'], data['dec_obs'] = ra, dec
+    for i, band in enumerate('ugriz'):
+        data[f'snr{band}'] = snrg * (0.3, 1, 1.3, 1.2, 0.8)[i]
+    data['class'] = 'STAR'
+    data['subclass'] = np.array(names)[kind]
+    data['z'] = rv / 299792.458
+    data['z_err'] = np.abs(rng.normal(0, 1e-5, n))
+    data['ps_id'] = index
+    data['ra'], data['dec'] = ra, dec
+    data['teff'], data['teff_err'] = teff, np.abs(rng.normal(50, 20, n))
+    data['logg'], data['logg_err'] = logg, np.abs(rng.normal(0.1, 0.03, n))
+    data['feh'], data['feh_err'] = feh, np.abs(rng.normal(0.05, 0.02, n))
+    data['rv'], data['rv_err'] = rv, np.abs(rng.normal(5, 2, n))
+    data['gaia_source_id'] = index * 7 + 1
+    data['gaia_g_mean_mag'] = rng.uniform(9, 17.8, n)
+    data['fibertype'] = 'Obj'
+    return data
+
+def make_catalog(path, n_rows, seed=0, chunk_rows=GENERATE_CHUNK_ROWS):
+    """分块写出n_rows行的合成星表FITS文件，内存只与chunk_rows有关"""
+    path = Path(path)
+    header = fits.BinTableHDU.from_columns(catalog_coldefs(), nrows=0).header
+    header['NAXIS2'] = n_rows
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(fits.PrimaryHDU().header.tostring().encode('ascii'))
+        f.write(header.tostring().encode('ascii'))
+        nbytes = 0
+        for start in range(0, n_rows, chunk_rows):
+            block = synthetic_rows(start, min(chunk_rows, n_rows - start), seed)
+            f.write(block.tobytes())
+            nbytes += block.nbytes
+        # 数据区补齐到2880字节的整数倍
+        f.write(b'\0' * (-nbytes % 2880))
+    os.replace(tmp_path, path)
+    return path
+
+def catalog_path(data_dir, n_rows, seed):
+    """合成星表的缓存文件，已存在时直接复用"""
+    path = Path(data_dir) / f'synthetic_lrs_{n_rows}_seed{seed}.fits'
+    if not path.exists():
+        logger.info(f"生成 {n_rows} 行的合成星表: {path}")
+        make_catalog(path, n_rows, seed)
+    return path
+
+def pandas_ingest(fits_path, output_dir):
+    """最初的读取方式（作为对照）：整表转为DataFrame后再筛选并写出CSV"""
+    with fits.open(fits_path) as hdul:
+        data = hdul[1].data
+        df = pd.DataFrame(data.tolist(), columns=data.names)
+        filtered = df[
+            (df['class'] == 'STAR') &
+            (df['subclass'].str[0].isin(['A', 'F', 'G'])) &
+            (df['snrg'] > 10)
+        ]
+        filtered['obsid'].to_csv(output_dir / 'AFG_obsid.txt', index=False, header=False)
+        columns = ['obsid', 'class', 'subclass', 'snrg', 'teff', 'logg', 'feh', 'ra', 'dec', 'z']
+        filtered[columns].to_csv(output_dir / 'AFG_params.csv', index=False)
+        filtered[['teff', 'logg', 'feh', 'snrg']].describe()
+
+def ingest_args(mode, fits_path, output_dir, workers, block_size):
+    """data_read.py在各模式下的参数；只写出CSV，与对照方式的输出相同"""
+    args = ['--fits', str(fits_path), '--output-dir', str(output_dir), '--format', 'csv',
+            '--nside', '0', '--partition-by', 'none', '--force']
+    if mode == 'chunked':
+        args += ['--stream', '--block-size', str(block_size)]
+    elif mode == 'parallel':
+        args += ['--workers', str(workers), '--block-size', str(block_size)]
+    return args
+
+@contextmanager
+def timed_calls(module, names, totals):
+    """在with块内替换module中的函数，把每个函数的累计耗时记入totals"""
+    originals = {name: getattr(module, name) for name in names}
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                totals[name] = totals.get(name, 0.0) + time.perf_counter() - start
+        return wrapper
+    for name, func in originals.items():
+        setattr(module, name, timed(name, func))
+    try:
+        yield totals
+    finally:
+        for name, func in originals.items():
+            setattr(module, name, func)
+
+def run_mode(mode, fits_path, output_dir, workers, block_size):
+    """在当前进程中执行一次读取，返回(读取耗时, 簿记耗时)（秒）。
+    读取耗时不含内容哈希和obsid索引，与对照方式可以直接比较"""
+    # 在计时之前导入，模块加载时间不计入读取耗时
+    import data_read
+    logging.getLogger().setLevel(logging.WARNING)
+    output_dir = Path(output_dir)
+    totals = {}
+    start = time.perf_counter()
+    if mode == 'pandas':
+        pandas_ingest(fits_path, output_dir)
+    else:
+        with timed_calls(data_read, BOOKKEEPING_CALLS, totals):
+            data_read.main(ingest_args(mode, fits_path, output_dir, workers, block_size))
+    elapsed = time.perf_counter() - start
+    bookkeeping = sum(totals.values())
+    return elapsed - bookkeeping, bookkeeping
+
+def peak_rss_mb(who):
+    # Linux上ru_maxrss的单位为KB；其中包括内存映射星表被访问过的页
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def rss_anon_mb(pid='self'):
+    """进程当前的匿名内存（/proc/<pid>/status中的RssAnon，MB），不含内存映射文件的页。
+    不支持时返回None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def child_pids():
+    """当前进程的直接子进程（扫描/proc下各进程的父进程号）"""
+    parent = os.getpid()
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名可能含空格，父进程号在最后一个')'之后的第2个字段
+        if int(stat.rsplit(')', 1)[1].split()[1]) == parent:
+            pids.append(name)
+    return pids
+
+class AnonMemorySampler:
+    """后台线程定期采样本进程（children为True时还有各子进程之和）的RssAnon，记录峰值。
+    ru_maxrss会把内存映射星表的页也算进去，匿名内存才反映实际分配的内存。
+    没有/proc的系统上峰值为None"""
+
+    def __init__(self, children=False, interval=ANON_SAMPLE_INTERVAL):
+        self.children = children
+        self.interval = interval
+        self.peak_mb = None
+        self.peak_children_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        current = rss_anon_mb()
+        if current is None:
+            return
+        self.peak_mb = max(self.peak_mb or 0.0, current)
+        if self.children:
+            total = sum(rss_anon_mb(pid) or 0.0 for pid in child_pids())
+            self.peak_children_mb = max(self.peak_children_mb or 0.0, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+def measure(mode, fits_path, workers, block_size):
+    """在独立的子进程中执行一次读取，峰值内存不受之前各次运行的影响"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        cmd = [sys.executable, __file__, '--run-one', mode, str(fits_path), output_dir,
+               '--workers', str(workers), '--block-size', str(block_size)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{mode} failed:\n{result.stderr}")
+        record = json.loads(result.stdout.strip().splitlines()[-1])
+        with open(Path(output_dir) / 'AFG_obsid.txt') as f:
+            record['output_rows'] = sum(1 for _ in f)
+    return record
+
+def run_benchmarks(rows_list, modes, data_dir, workers, block_size, repeat, seed):
+    records = []
+    for n_rows in rows_list:
+        fits_path = catalog_path(data_dir, n_rows, seed)
+        for mode in modes:
+            runs = [measure(mode, fits_path, workers, block_size) for _ in range(repeat)]
+            best = min(runs, key=lambda r: r['seconds'])
+            record = {
+                'rows': n_rows,
+                'mode': mode,
+                'seconds': best['seconds'],
+                'bookkeeping_seconds': best['bookkeeping_seconds'],
+                'rows_per_second': n_rows / best['seconds'],
+                'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+                'peak_child_rss_mb': max(r['peak_child_rss_mb'] for r in runs),
+                'peak_anon_mb': max_or_none(r['peak_anon_mb'] for r in runs),
+                'peak_child_anon_mb': max_or_none(r['peak_child_anon_mb'] for r in runs),
+                'output_rows': best['output_rows'],
+                'repeat': repeat,
+            }
+            anon = record['peak_anon_mb']
+            logger.info(f"{n_rows:>10} 行 {mode:<9} {record['seconds']:8.2f} 秒"
+                        f"（另有哈希和索引 {record['bookkeeping_seconds']:.2f} 秒） "
+                        f"峰值RSS {record['peak_rss_mb']:8.1f} MB（子进程 {record['peak_child_rss_mb']:.1f} MB） "
+                        f"峰值匿名内存 {'-' if anon is None else f'{anon:.1f}'} MB")
+            records.append(record)
+    return records
+
+def max_or_none(values):
+    """各次运行的最大值；不支持采样（值为None）时返回None"""
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+def environment_info():
+    import astropy
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'astropy': astropy.__version__,
+    }
+
+def compare_results(records, baseline_records, tolerance=DEFAULT_TOLERANCE):
+    """与之前保存的结果比较，返回耗时或峰值内存超出容差的记录说明"""
+    baseline = {(r['rows'], r['mode']): r for r in baseline_records}
+    regressions = []
+    for record in records:
+        old = baseline.get((record['rows'], record['mode']))
+        if old is None:
+            continue
+        for key in ('seconds', 'peak_rss_mb', 'peak_anon_mb'):
+            # 旧的结果文件可能没有某些指标，或者当时的系统不支持采样
+            if record.get(key) is None or old.get(key) is None:
+                continue
+            if record[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{record['rows']} rows {record['mode']}: {key} "
+                                   f"{old[key]:.2f} -> {record[key]:.2f}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='data_read.py各读取模式的基准测试（合成的DR10规模星表）')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help='合成星表的行数，可给多个（默认 100000 1000000，最多可到 20000000）')
+    parser.add_argument('--modes', nargs='+', choices=INGEST_MODES, default=list(INGEST_MODES),
+                        help='pandas为最初的整表DataFrame方式，columnar为列裁剪+谓词下推，'
+                             'chunked为流式分块，parallel为多进程')
+    parser.add_argument('--data-dir', type=Path, default=None,
+                        help='合成星表的保存目录（默认 data/benchmark，已生成的星表会被复用）')
+    parser.add_argument('--output', type=Path, default=None,
+                        help='结果文件（JSON，默认 data/benchmark/ingest_results.json）')
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='与之前的结果文件比较，耗时或峰值内存超过容差时以非零状态退出')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'比较时允许的相对增加（默认 {DEFAULT_TOLERANCE}）')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='parallel模式的进程数')
+    parser.add_argument('--block-size', type=int, default=500_000, help='chunked/parallel模式每块的行数')
+    parser.add_argument('--repeat', type=int, default=1, help='每种模式重复次数，取最快的一次')
+    parser.add_argument('--seed', type=int, default=0, help='合成星表的随机种子')
+    parser.add_argument('--run-one', nargs=3, metavar=('MODE', 'FITS', 'OUTPUT_DIR'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.run_one:
+        # 子进程：执行一次读取并输出耗时和峰值内存
+        mode, fits_path, output_dir = args.run_one
+        # 只有parallel模式有子进程，其他模式不扫描/proc，采样线程尽量不占用CPU
+        with AnonMemorySampler(children=mode == 'parallel') as sampler:
+            seconds, bookkeeping = run_mode(mode, fits_path, output_dir, args.workers, args.block_size)
+        print(json.dumps({'seconds': seconds,
+                          'bookkeeping_seconds': bookkeeping,
+                          'peak_rss_mb': peak_rss_mb(resource.RUSAGE_SELF),
+                          'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+                          'peak_anon_mb': sampler.peak_mb,
+                          'peak_child_anon_mb': sampler.peak_children_mb}))
+        return 0
+
+    benchmark_dir = Path(__file__).parent.parent / 'data' / 'benchmark'
+    data_dir = args.data_dir or benchmark_dir
+    data_dir.mkdir(parents=True, exist_ok=True)
+    output = args.output or benchmark_dir / 'ingest_results.json'
+    records = run_benchmarks(args.rows, args.modes, data_dir, args.workers, args.block_size,
+                             args.repeat, args.seed)
+    results = {
+        'environment': environment_info(),
+        'settings': {'workers': args.workers, 'block_size': args.block_size, 'seed': args.seed},
+        'results': records,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    logger.info(f"基准测试结果已保存到: {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare_results(records, json.load(f)['results'], args.tolerance)
+        for line in regressions:
+            logger.warning(f"性能退化: {line}")
+        if regressions:
+            return 1
+        logger.info("与基准结果相比没有性能退化")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
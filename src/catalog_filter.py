@@ -0,0 +1,192 @@
+import ast
+import io
+import keyword
+import tokenize
+from functools import lru_cache, reduce
+
+import numpy as np
+
+# 筛选表达式示例：
+#   "class == 'STAR' and subclass[0] in 'AFG' and snrg > 10 and teff < 8000"
+# 支持：列名、数值/字符串常量、比较（可链式）、and/or/not、in/not in、
+# 四则运算、abs()，以及对字符串列取单个字符（subclass[0]）或前缀切片（subclass[:2]）。
+
+# 表达式中用到的Python关键字（and/or/not/in等）之外的关键字都当作列名，例如 class
+_OPERATOR_KEYWORDS = {'and', 'or', 'not', 'in', 'is', 'True', 'False', 'None'}
+_KEYWORD_PREFIX = '_column_'
+
+_COMPARE_OPS = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Mod: np.mod,
+}
+
+_FUNCTIONS = {
+    'abs': np.abs,
+}
+
+def _is_strings(value):
+    return isinstance(value, np.ndarray) and value.dtype.kind in 'SU'
+
+def _char_width(col):
+    return col.dtype.itemsize // (4 if col.dtype.kind == 'U' else 1)
+
+def _encode_like(value, other):
+    """字节串列与str常量比较时把常量编码为bytes"""
+    if _is_strings(other) and other.dtype.kind == 'S':
+        if isinstance(value, str):
+            return value.encode('ascii')
+        if isinstance(value, list):
+            return [_encode_like(v, other) for v in value]
+    return value
+
+def _strip(value):
+    return np.char.rstrip(value) if _is_strings(value) else value
+
+def _contains(left, right):
+    """in运算：右侧为字符串常量时按子串判断（空字符串不算匹配），为列表时按成员判断"""
+    right = _encode_like(right, left)
+    if isinstance(right, (str, bytes)):
+        left = _strip(left)
+        if _char_width(left) == 1:
+            chars = [right[i:i + 1] for i in range(len(right))]
+            return np.isin(left, chars)
+        return (np.char.find(right, left) >= 0) & (np.char.str_len(left) > 0)
+    return np.isin(_strip(left), right)
+
+def _compare(op, left, right):
+    if op in (ast.In, ast.NotIn):
+        mask = _contains(left, right)
+        return ~mask if op is ast.NotIn else mask
+    left, right = _encode_like(left, right), _encode_like(right, left)
+    if op in (ast.Eq, ast.NotEq):
+        left, right = _strip(left), _strip(right)
+    return _COMPARE_OPS[op](left, right)
+
+def _slice_strings(col, key):
+    """对定长字符串列按字符下标/切片取子串（向量化，不逐元素循环）"""
+    if not _is_strings(col):
+        raise ValueError("Only string columns can be indexed in filter expressions")
+    col = np.ascontiguousarray(col)
+    kind = col.dtype.kind
+    chars = col.view(f'{kind}1').reshape(len(col), _char_width(col))[:, key]
+    if chars.ndim == 1:
+        return chars
+    if chars.shape[1] == 0:
+        return np.zeros(len(col), dtype=f'{kind}1')
+    return np.ascontiguousarray(chars).view(f'{kind}{chars.shape[1]}').ravel()
+
+def _constant_index(node):
+    value = node.value if isinstance(node, ast.Constant) else None
+    if node is not None and (not isinstance(value, int) or value < 0):
+        raise ValueError("String indices in filter expressions must be non-negative integers")
+    return value
+
+def _escape_keywords(expr):
+    """把与Python关键字同名的列名（如class）改写为合法标识符，才能用ast解析"""
+    tokens = []
+    for tok in tokenize.generate_tokens(io.StringIO(expr).readline):
+        if (tok.type == tokenize.NAME and keyword.iskeyword(tok.string)
+                and tok.string not in _OPERATOR_KEYWORDS):
+            tok = tok._replace(string=_KEYWORD_PREFIX + tok.string)
+        tokens.append((tok.type, tok.string))
+    return tokenize.untokenize(tokens)
+
+def _compile(node, columns):
+    """把AST节点编译为 env -> ndarray 的函数，env(name) 返回列数据"""
+    if isinstance(node, ast.Expression):
+        return _compile(node.body, columns)
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile(value, columns) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return lambda env: reduce(combine, (part(env) for part in parts))
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile(node.operand, columns)
+        if isinstance(node.op, ast.Not):
+            return lambda env: np.logical_not(operand(env))
+        if isinstance(node.op, ast.USub):
+            return lambda env: np.negative(operand(env))
+        if isinstance(node.op, ast.UAdd):
+            return operand
+    if isinstance(node, ast.Compare):
+        operands = [_compile(node.left, columns)] + [_compile(c, columns) for c in node.comparators]
+        ops = [type(op) for op in node.ops]
+        if any(op not in _COMPARE_OPS and op not in (ast.In, ast.NotIn) for op in ops):
+            raise ValueError(f"Unsupported comparison in filter expression: {ast.unparse(node)}")
+        def compare(env):
+            values = [operand(env) for operand in operands]
+            masks = [_compare(op, values[i], values[i + 1]) for i, op in enumerate(ops)]
+            return reduce(np.logical_and, masks)
+        return compare
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        left, right = _compile(node.left, columns), _compile(node.right, columns)
+        func = _BINARY_OPS[type(node.op)]
+        return lambda env: func(left(env), right(env))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS:
+        if len(node.args) != 1 or node.keywords:
+            raise ValueError(f"{node.func.id}() takes exactly one argument")
+        arg = _compile(node.args[0], columns)
+        func = _FUNCTIONS[node.func.id]
+        return lambda env: func(arg(env))
+    if isinstance(node, ast.Subscript):
+        value = _compile(node.value, columns)
+        if isinstance(node.slice, ast.Slice):
+            if node.slice.step is not None:
+                raise ValueError("Slice steps are not supported in filter expressions")
+            key = slice(_constant_index(node.slice.lower), _constant_index(node.slice.upper))
+        else:
+            key = _constant_index(node.slice)
+        return lambda env: _slice_strings(value(env), key)
+    if isinstance(node, ast.Name):
+        name = node.id.removeprefix(_KEYWORD_PREFIX)
+        columns.add(name)
+        return lambda env: env(name)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str, bool)):
+        value = node.value
+        return lambda env: value
+    if isinstance(node, (ast.Tuple, ast.List)):
+        if not all(isinstance(e, ast.Constant) for e in node.elts):
+            raise ValueError("Only constants are allowed in filter expression lists")
+        values = [e.value for e in node.elts]
+        return lambda env: values
+    raise ValueError(f"Unsupported syntax in filter expression: {ast.unparse(node)}")
+
+class CompiledFilter:
+    """编译后的筛选表达式，调用时传入按列名取数据的函数，返回布尔掩码"""
+
+    def __init__(self, expr):
+        self.expr = expr
+        try:
+            tree = ast.parse(_escape_keywords(expr).strip(), mode='eval')
+        except (SyntaxError, tokenize.TokenError) as e:
+            raise ValueError(f"Invalid filter expression {expr!r}: {e.args[0]}") from None
+        self.columns = set()
+        self._evaluate = _compile(tree, self.columns)
+
+    def __call__(self, get_column):
+        # 同一次求值中每列只读取一次
+        cache = {}
+        def env(name):
+            if name not in cache:
+                cache[name] = get_column(name)
+            return cache[name]
+        return self._evaluate(env)
+
+    def __repr__(self):
+        return f"CompiledFilter({self.expr!r})"
+
+@lru_cache(maxsize=128)
+def compile_filter(expr):
+    """编译筛选表达式（结果会被缓存，分块处理时不会重复编译）"""
+    return CompiledFilter(expr)
@@ -0,0 +1,153 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# 默认统计的参数列
+STATS_COLUMNS = ['teff', 'logg', 'feh', 'snrg']
+
+# describe输出中的分位数
+QUANTILES = (0.25, 0.5, 0.75)
+
+class QuantileSketch:
+    """相对误差分位数草图（DDSketch）：按对数分桶计数，可分块更新、可合并。
+    估计出的分位数与真实值的相对误差不超过relative_accuracy"""
+
+    def __init__(self, relative_accuracy=0.001):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def _add_buckets(self, counter, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64),
+                                 return_counts=True)
+        counter.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self._add_buckets(self.positive, values[values > 0])
+        self._add_buckets(self.negative, -values[values < 0])
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def _bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        # 从小到大遍历：负数桶（绝对值从大到小）、零、正数桶
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive))
+
+class RunningStats:
+    """单列的可合并单遍统计：计数、均值、方差（Chan合并公式）、最小/最大值和近似分位数"""
+
+    def __init__(self, relative_accuracy=0.001):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def _combine(self, count, mean, m2, vmin, vmax):
+        total = self.count + count
+        if count == 0:
+            return
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            mean = values.mean()
+            self._combine(len(values), mean, float(((values - mean) ** 2).sum()),
+                          values.min(), values.max())
+            self.sketch.update(values)
+        return self
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    def summary(self):
+        """与pandas describe相同的统计项"""
+        empty = self.count == 0
+        result = {
+            'count': float(self.count),
+            'mean': np.nan if empty else self.mean,
+            'std': self.std,
+            'min': np.nan if empty else self.min,
+        }
+        for q in QUANTILES:
+            result[f'{q:.0%}'] = np.clip(self.sketch.quantile(q), self.min, self.max) if not empty else np.nan
+        result['max'] = np.nan if empty else self.max
+        return result
+
+class CatalogStats:
+    """多列统计累加器：可逐块update，也可以在类型/进程之间merge"""
+
+    def __init__(self, columns=STATS_COLUMNS, relative_accuracy=0.001):
+        self.columns = list(columns)
+        self.stats = {name: RunningStats(relative_accuracy) for name in self.columns}
+
+    def update(self, df):
+        for name in self.columns:
+            self.stats[name].update(df[name].to_numpy())
+        return self
+
+    def merge(self, other):
+        for name in self.columns:
+            self.stats[name].merge(other.stats[name])
+        return self
+
+    @classmethod
+    def combine(cls, stats_list, columns=STATS_COLUMNS):
+        merged = cls(columns)
+        for stats in stats_list:
+            merged.merge(stats)
+        return merged
+
+    def describe(self):
+        """返回与DataFrame.describe()格式相同的统计表（分位数为近似值）"""
+        return pd.DataFrame({name: self.stats[name].summary() for name in self.columns})
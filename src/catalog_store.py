@@ -0,0 +1,420 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import astropy.units as u
+from astropy_healpix import HEALPix
+
+from ingest_state import replace_atomically
+
+logger = logging.getLogger(__name__)
+
+# 处理后参数表的列类型：参数为float32，obsid为int64，类型列为字典编码（读出即为categorical）
+PARAM_TYPES = {
+    'obsid': pa.int64(),
+    'class': pa.dictionary(pa.int32(), pa.string()),
+    'subclass': pa.dictionary(pa.int32(), pa.string()),
+    'snrg': pa.float32(),
+    'teff': pa.float32(),
+    'logg': pa.float32(),
+    'feh': pa.float32(),
+    'ra': pa.float64(),
+    'dec': pa.float64(),
+    'z': pa.float64(),
+    'star_id': pa.int64(),
+}
+
+# 读取CSV时使用的对应pandas类型
+PARAM_DTYPES = {
+    'obsid': 'int64',
+    'class': 'category',
+    'subclass': 'category',
+    'snrg': 'float32',
+    'teff': 'float32',
+    'logg': 'float32',
+    'feh': 'float32',
+    'ra': 'float64',
+    'dec': 'float64',
+    'z': 'float64',
+    'star_id': 'int64',
+}
+
+# Parquet每个row group的行数，也是zone map的粒度：选择性查询以row group为单位跳过
+DEFAULT_ROW_GROUP_SIZE = 2_000
+
+# 按块读取参数表时默认每块的行数
+DEFAULT_CHUNK_SIZE = 50_000
+
+# 记录zone map（每个row group的最小/最大值）的列
+ZONE_COLUMNS = ['teff', 'logg', 'feh', 'snrg', 'ra', 'dec', 'obsid']
+
+# Parquet参数表写出前的行顺序：先按粗分的HEALPix像素，像素内再按有效温度排序。
+# 每个row group只覆盖一小块天区和一段有效温度，天区和温度查询都能跳过大部分row group。
+# 像素分得越细天区查询越快，但每个有星的像素至少有一个row group会被温度查询读到，
+# 所以像素随行数变细，保持每个像素平均CLUSTER_GROUPS_PER_PIXEL个row group
+CLUSTER_SORT_COLUMN = 'teff'
+CLUSTER_GROUPS_PER_PIXEL = 4
+CLUSTER_MAX_NSIDE = 64
+
+# 按zone map判断row group能否满足(列, 运算符, 值)条件：(最小值, 最大值, 值) -> bool
+ZONE_OPS = {
+    '==': lambda lo, hi, value: lo <= value <= hi,
+    '!=': lambda lo, hi, value: not lo == hi == value,
+    '>': lambda lo, hi, value: hi > value,
+    '>=': lambda lo, hi, value: hi >= value,
+    '<': lambda lo, hi, value: lo < value,
+    '<=': lambda lo, hi, value: lo <= value,
+    'in': lambda lo, hi, values: any(lo <= v <= hi for v in values),
+    'between': lambda lo, hi, bounds: hi >= bounds[0] and lo <= bounds[1],
+}
+
+# 对读出的行做精确筛选
+PARAM_OPS = {
+    '==': lambda col, value: col == value,
+    '!=': lambda col, value: col != value,
+    '>': lambda col, value: col > value,
+    '>=': lambda col, value: col >= value,
+    '<': lambda col, value: col < value,
+    '<=': lambda col, value: col <= value,
+    'in': lambda col, values: col.isin(values),
+    'between': lambda col, bounds: col.between(*bounds),
+}
+
+def cluster_pixels(df, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """聚类用的nested HEALPix像素编号。从CLUSTER_MAX_NSIDE逐级合并到平均每个有星的像素
+    至少有CLUSTER_GROUPS_PER_PIXEL个row group（nested编号右移两位即上一级像素），坐标缺失的行排在最后"""
+    ra = df['ra'].to_numpy(dtype=np.float64)
+    dec = df['dec'].to_numpy(dtype=np.float64)
+    pixels = np.full(len(df), 12 * CLUSTER_MAX_NSIDE ** 2, dtype=np.int64)
+    valid = np.isfinite(ra) & np.isfinite(dec)
+    pixels[valid] = HEALPix(nside=CLUSTER_MAX_NSIDE, order='nested').lonlat_to_healpix(ra[valid] * u.deg,
+                                                                                       dec[valid] * u.deg)
+    max_pixels = len(df) / (CLUSTER_GROUPS_PER_PIXEL * row_group_size)
+    nside = CLUSTER_MAX_NSIDE
+    while nside > 1 and len(np.unique(pixels)) > max_pixels:
+        pixels >>= 2
+        nside //= 2
+    return pixels
+
+def cluster_order(df):
+    """先按天区像素、像素内再按CLUSTER_SORT_COLUMN排序的行位置"""
+    return np.lexsort((df[CLUSTER_SORT_COLUMN].to_numpy(), cluster_pixels(df)))
+
+def cluster_rows(df):
+    """把要写入Parquet的行按天区和有效温度重新排列"""
+    if len(df) < 2:
+        return df
+    return df.iloc[cluster_order(df)].reset_index(drop=True)
+
+def params_schema(columns):
+    """根据列名生成Arrow schema，未登记的列按字符串处理"""
+    return pa.schema([(name, PARAM_TYPES.get(name, pa.string())) for name in columns])
+
+def to_arrow(df, schema=None):
+    """把参数DataFrame转换为固定schema的Arrow表（保证分块写出时schema一致）"""
+    schema = schema or params_schema(df.columns)
+    arrays = [pa.array(df[field.name], from_pandas=True).cast(field.type) for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_params(df, path, zones=True):
+    """把参数表写为Parquet文件，并写出zone map（zones为False时不写）"""
+    pq.write_table(to_arrow(df), path, row_group_size=DEFAULT_ROW_GROUP_SIZE)
+    if zones:
+        write_zone_map(path)
+
+def append_params(df, path):
+    """把新增的行追加到已有的Parquet参数表（重写为新文件后原子替换）"""
+    path = Path(path)
+    new_table = to_arrow(df)
+    if path.exists():
+        existing = pq.read_table(path, memory_map=True).cast(new_table.schema)
+        new_table = pa.concat_tables([existing, new_table])
+    replace_atomically(path, lambda tmp_path: pq.write_table(new_table, tmp_path,
+                                                             row_group_size=DEFAULT_ROW_GROUP_SIZE))
+    write_zone_map(path)
+
+class ParamsWriter:
+    """分块追加写出Parquet参数表（流式模式使用）。正常结束时写出zone map；
+    出错退出时删除写了一半的文件，不留下看起来完整的参数表"""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.schema = params_schema(columns)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, df):
+        if len(df):
+            self.writer.write_table(to_arrow(df, self.schema), row_group_size=DEFAULT_ROW_GROUP_SIZE)
+
+    def close(self):
+        self.writer.close()
+        write_zone_map(self.path)
+
+    def abort(self):
+        self.writer.close()
+        remove_params(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def zone_map_path(path):
+    """Parquet参数表对应的zone map文件，例如 AFG_params_zones.json"""
+    path = Path(path)
+    return path.with_name(f'{path.stem}_zones.json')
+
+def remove_params(path):
+    """删除Parquet参数表及其zone map"""
+    Path(path).unlink(missing_ok=True)
+    zone_map_path(path).unlink(missing_ok=True)
+
+def build_zone_map(path, columns=ZONE_COLUMNS):
+    """从Parquet文件尾部的row group统计信息生成zone map，不需要读取数据页。
+    统计信息中不含NaN；整块都是NaN的列不记录，读取时视为可能满足条件"""
+    metadata = pq.ParquetFile(path).metadata
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    chunks = []
+    start = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        zones = {}
+        for name in columns:
+            if name not in names:
+                continue
+            stats = row_group.column(names.index(name)).statistics
+            if stats is not None and stats.has_min_max:
+                zones[name] = [stats.min, stats.max]
+        chunks.append({'rows': [start, start + row_group.num_rows], 'zones': zones})
+        start += row_group.num_rows
+    return {'columns': [name for name in columns if name in names], 'chunks': chunks}
+
+def write_zone_map(path):
+    """生成并保存Parquet参数表的zone map"""
+    zone_map = build_zone_map(path)
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(zone_map, f)
+    replace_atomically(zone_map_path(path), write)
+    return zone_map
+
+def load_zone_map(path):
+    """读取zone map；不存在时从Parquet文件尾部重新生成"""
+    zones_file = zone_map_path(path)
+    if not zones_file.exists():
+        return build_zone_map(path)
+    with open(zones_file) as f:
+        return json.load(f)
+
+def chunk_may_match(zones, filters):
+    """根据一个row group的最小/最大值判断其中是否可能有满足全部条件的行"""
+    for name, op, value in filters:
+        if op not in PARAM_OPS:
+            raise ValueError(f"Unsupported predicate operator: {op}")
+        if name in zones and not ZONE_OPS[op](*zones[name], value):
+            return False
+    return True
+
+def filter_params(df, filters):
+    """按(列, 运算符, 值)条件精确筛选参数表"""
+    mask = np.ones(len(df), dtype=bool)
+    for name, op, value in filters:
+        if op not in PARAM_OPS:
+            raise ValueError(f"Unsupported predicate operator: {op}")
+        mask &= np.asarray(PARAM_OPS[op](df[name], value), dtype=bool)
+    return df[mask].reset_index(drop=True)
+
+def read_params_where(path, filters, columns=None):
+    """选择性读取Parquet参数表：先用zone map跳过不可能满足条件的row group，
+    只读取候选row group后再精确筛选"""
+    zone_map = load_zone_map(path)
+    candidates = [i for i, chunk in enumerate(zone_map['chunks'])
+                  if chunk_may_match(chunk['zones'], filters)]
+    logger.info(f"zone map: 读取 {len(candidates)}/{len(zone_map['chunks'])} 个row group")
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys([*columns, *(name for name, _, _ in filters)]))
+    table = pq.ParquetFile(path, memory_map=True).read_row_groups(candidates, columns=read_columns)
+    df = filter_params(table.to_pandas(), filters)
+    return df if columns is None else df[list(columns)]
+
+def read_params(path, columns=None):
+    """以内存映射方式读取Parquet参数表"""
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+def load_params(processed_dir, name='AFG_params', columns=None, filters=None):
+    """读取处理后的参数表：优先读取Parquet，不存在时回退到CSV。
+    给出filters（(列, 运算符, 值)列表）时只返回满足条件的行，Parquet按zone map跳过无关的row group"""
+    processed_dir = Path(processed_dir)
+    parquet_file = processed_dir / f'{name}.parquet'
+    if parquet_file.exists():
+        logger.info(f"Reading data from: {parquet_file}")
+        if filters:
+            return read_params_where(parquet_file, filters, columns)
+        return read_params(parquet_file, columns)
+    csv_file = processed_dir / f'{name}.csv'
+    logger.info(f"Reading data from: {csv_file}")
+    if filters:
+        read_columns = None if columns is None else list(dict.fromkeys([*columns, *(f[0] for f in filters)]))
+        df = filter_params(pd.read_csv(csv_file, usecols=read_columns, dtype=PARAM_DTYPES), filters)
+        return df if columns is None else df[list(columns)]
+    return pd.read_csv(csv_file, usecols=columns, dtype=PARAM_DTYPES)
+
+def iter_params(processed_dir, name='AFG_params', chunk_size=DEFAULT_CHUNK_SIZE, columns=None):
+    """按块读取处理后的参数表，逐块产出DataFrame，内存只与块大小有关。
+    优先读取Parquet，不存在时回退到CSV"""
+    processed_dir = Path(processed_dir)
+    parquet_file = processed_dir / f'{name}.parquet'
+    if parquet_file.exists():
+        logger.info(f"Reading data in chunks from: {parquet_file}")
+        for batch in pq.ParquetFile(parquet_file, memory_map=True).iter_batches(chunk_size, columns=columns):
+            yield batch.to_pandas()
+        return
+    csv_file = processed_dir / f'{name}.csv'
+    logger.info(f"Reading data in chunks from: {csv_file}")
+    with pd.read_csv(csv_file, usecols=columns, dtype=PARAM_DTYPES, chunksize=chunk_size) as reader:
+        yield from reader
+
+# 分区方式：按光谱类型（subclass首字母）或完整的subclass
+PARTITION_BY = ('type', 'subclass')
+
+# subclass缺失（或为空字符串）的行单独放在这个分区里，不属于任何光谱类型
+MISSING_PARTITION = '_missing'
+
+def partition_dir(processed_dir, by, name='AFG_params'):
+    """分区目录，例如 AFG_params_by_type/"""
+    return Path(processed_dir) / f'{name}_by_{by}'
+
+def partition_keys(df, by):
+    """每行所属的分区：只对subclass的类别做字符串运算，再按类别编码展开。
+    subclass缺失的行（类别编码为-1）归入MISSING_PARTITION"""
+    col = df['subclass'].astype('category')
+    categories = col.cat.categories.astype(str)
+    keys = categories.str[0] if by == 'type' else categories
+    keys = np.append(keys.fillna(MISSING_PARTITION).to_numpy(dtype=object), MISSING_PARTITION)
+    keys[keys == ''] = MISSING_PARTITION
+    # 编码-1正好取到末尾追加的MISSING_PARTITION
+    return keys[col.cat.codes.to_numpy()]
+
+def write_manifest(directory, by):
+    """根据目录中的分区文件生成清单：分区键、文件名、行数和所属光谱类型"""
+    directory = Path(directory)
+    partitions = {}
+    for path in sorted(directory.glob('*.parquet')):
+        partitions[path.stem] = {
+            'file': path.name,
+            'rows': pq.ParquetFile(path).metadata.num_rows,
+            'type': None if path.stem == MISSING_PARTITION else path.stem[0],
+        }
+    manifest = {'partition_by': by, 'partitions': partitions}
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+    replace_atomically(directory / 'manifest.json', write)
+    return manifest
+
+def clear_partitions(directory):
+    """完整重写前删除旧的分区文件，避免残留已不存在的分区"""
+    directory = Path(directory)
+    for pattern in ('*.parquet', '*_zones.json', 'manifest.json'):
+        for path in directory.glob(pattern):
+            path.unlink()
+
+class PartitionedWriter:
+    """按分区分块追加写出Parquet参数表，每个分区一个文件，正常关闭时写出清单；
+    出错退出时删除已写的分区文件，不写清单"""
+
+    def __init__(self, directory, by, columns):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        clear_partitions(self.directory)
+        self.by = by
+        self.columns = columns
+        self.writers = {}
+
+    def write(self, df):
+        if len(df) == 0:
+            return
+        for key, part in df.groupby(partition_keys(df, self.by), sort=False):
+            if key not in self.writers:
+                self.writers[key] = ParamsWriter(self.directory / f'{key}.parquet', self.columns)
+            self.writers[key].write(part)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        write_manifest(self.directory, self.by)
+
+    def abort(self):
+        for writer in self.writers.values():
+            writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_partitions(df, directory, by):
+    """把参数表按分区写出"""
+    with PartitionedWriter(directory, by, list(df.columns)) as writer:
+        writer.write(df)
+
+def append_partitions(df, directory, by):
+    """把新增的行追加到各自的分区文件并更新清单"""
+    directory = Path(directory)
+    for key, part in df.groupby(partition_keys(df, by), sort=False):
+        append_params(part, directory / f'{key}.parquet')
+    write_manifest(directory, by)
+
+def load_manifest(processed_dir, by='type', name='AFG_params'):
+    """读取分区清单，不存在时返回None"""
+    manifest_file = partition_dir(processed_dir, by, name) / 'manifest.json'
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+def _partition_files(processed_dir, keys, by, name):
+    manifest = load_manifest(processed_dir, by, name)
+    directory = partition_dir(processed_dir, by, name)
+    if manifest is None:
+        raise FileNotFoundError(directory / 'manifest.json')
+    for key, entry in manifest['partitions'].items():
+        if keys is None or key in keys:
+            yield key, directory / entry['file']
+
+def iter_partitions(processed_dir, keys=None, by='type', name='AFG_params', columns=None):
+    """逐个读取分区，返回(分区键, DataFrame)；keys为空时读取全部分区"""
+    for key, path in _partition_files(processed_dir, keys, by, name):
+        yield key, read_params(path, columns)
+
+def load_partitions(processed_dir, keys=None, by='type', name='AFG_params', columns=None,
+                    key_column=None):
+    """读取若干分区并合并；给出key_column时把分区键作为categorical列附加到结果中"""
+    tables = []
+    for key, path in _partition_files(processed_dir, keys, by, name):
+        table = pq.read_table(path, columns=columns, memory_map=True)
+        if key_column is not None:
+            # subclass缺失的分区没有类型，分区键列为空值
+            indices = pa.array(np.zeros(len(table), dtype=np.int32),
+                               mask=np.full(len(table), key == MISSING_PARTITION))
+            keys_array = pa.DictionaryArray.from_arrays(indices, pa.array([key]))
+            table = table.append_column(key_column, keys_array)
+        tables.append(table)
+    if not tables:
+        raise ValueError(f"No partitions match {keys}")
+    # 合并时Arrow会统一各分区的字典，结果中的类型列仍为categorical
+    return pa.concat_tables(tables).to_pandas()
@@ -0,0 +1,183 @@
+import bz2
+import gzip
+import os
+from pathlib import Path
+
+import numpy as np
+import astropy
+from astropy.io import fits
+
+# 整个文件压缩的星表（.fits.gz / .fits.bz2）：按流解压，只能顺序读取
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+}
+
+# FITS文件按2880字节的块存储
+FITS_BLOCK = 2880
+
+# fpack压缩表（ZTABLE）中RICE_1算法的块大小
+RICE_BLOCK_SIZE = 32
+
+# 压缩表头中还原原始表头时需要去掉的关键字
+_ZTABLE_KEYS = ('ZTABLE', 'ZTILELEN', 'ZNAXIS1', 'ZNAXIS2', 'ZPCOUNT', 'ZHEAPPTR', 'CHECKSUM', 'DATASUM')
+
+def is_stream_compressed(fits_path):
+    return Path(fits_path).suffix.lower() in COMPRESSED_OPENERS
+
+def is_tile_compressed(header):
+    return bool(header.get('ZTABLE', False))
+
+def is_compressed_catalog(fits_path):
+    """星表是否压缩存储（整个文件gzip/bzip2压缩，或fpack分块压缩的表），
+    这类文件不能内存映射，只能分块解压读取"""
+    if is_stream_compressed(fits_path):
+        return True
+    return is_tile_compressed(fits.getheader(fits_path, 1))
+
+def _data_size(header):
+    """HDU数据区（含补齐到2880字节的填充）的字节数"""
+    naxis = header.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    shape = [header[f'NAXIS{i}'] for i in range(1, naxis + 1)]
+    size = abs(header['BITPIX']) // 8 * header.get('GCOUNT', 1) * (header.get('PCOUNT', 0) + int(np.prod(shape)))
+    return -(-size // FITS_BLOCK) * FITS_BLOCK
+
+def _read_table_header(f, ext=1):
+    """从解压流中读取第ext个HDU的表头，前面各HDU的数据直接跳过"""
+    for _ in range(ext):
+        header = fits.Header.fromfile(f)
+        f.seek(_data_size(header), os.SEEK_CUR)
+    return fits.Header.fromfile(f)
+
+def uncompressed_header(header):
+    """由fpack压缩表的表头还原原始表的表头"""
+    original = header.copy()
+    original['NAXIS1'] = header['ZNAXIS1']
+    original['NAXIS2'] = header['ZNAXIS2']
+    original['PCOUNT'] = header.get('ZPCOUNT', 0)
+    for i in range(1, header['TFIELDS'] + 1):
+        original[f'TFORM{i}'] = header[f'ZFORM{i}']
+        original.remove(f'ZFORM{i}', ignore_missing=True)
+        original.remove(f'ZCTYP{i}', ignore_missing=True)
+    for key in _ZTABLE_KEYS:
+        original.remove(key, ignore_missing=True)
+    return original
+
+def table_header(fits_path):
+    """星表（第1个扩展）的原始表头；压缩文件只解压开头的表头部分"""
+    if is_stream_compressed(fits_path):
+        with COMPRESSED_OPENERS[Path(fits_path).suffix.lower()](fits_path, 'rb') as f:
+            header = _read_table_header(f)
+    else:
+        header = fits.getheader(fits_path, 1)
+    return uncompressed_header(header) if is_tile_compressed(header) else header
+
+def table_row_count(fits_path):
+    return table_header(fits_path)['NAXIS2']
+
+def _rows_to_table(header, rows):
+    """把若干行的原始字节（形状为(行数, 行宽)的uint8数组）构造成FITS_rec，与内存映射读取的结果一致"""
+    header = header.copy()
+    header['NAXIS2'] = len(rows)
+    return fits.BinTableHDU.fromstring(header.tostring().encode('ascii') + rows.tobytes()).data
+
+def _check_streamable(header, fits_path):
+    if header.get('PCOUNT', 0):
+        raise ValueError(f"{fits_path}: tables with variable-length columns cannot be read in blocks")
+
+def _iter_stream_rows(fits_path, block_size):
+    """gzip/bzip2压缩的星表：边解压边按块读取行，不需要把整个文件解压到内存或临时文件"""
+    with COMPRESSED_OPENERS[Path(fits_path).suffix.lower()](fits_path, 'rb') as f:
+        header = _read_table_header(f)
+        if is_tile_compressed(header):
+            raise ValueError(f"{fits_path}: fpack-compressed tables must not be gzip-compressed again")
+        _check_streamable(header, fits_path)
+        row_bytes, total = header['NAXIS1'], header['NAXIS2']
+        yield header
+        for start in range(0, total, block_size):
+            n = min(block_size, total - start)
+            buf = f.read(n * row_bytes)
+            if len(buf) < n * row_bytes:
+                raise EOFError(f"{fits_path}: truncated after {start} rows")
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(n, row_bytes)
+
+def _decode_tile_column(compressed, algorithm, dtype, n_rows):
+    """解压一个tile中的一列，返回按行排列的原始（大端）字节，形状为(行数, 列宽)"""
+    # astropy的私有编解码模块只有fpack压缩表才需要，在这里导入，其他输入不依赖它
+    try:
+        from astropy.io.fits.hdu.compressed._codecs import Gzip1, Gzip2, NoCompress, Rice1
+    except ImportError as e:
+        raise ImportError(f"读取fpack压缩表需要astropy的tile编解码模块（astropy 6.1起提供，已在8.0上验证），"
+                          f"当前astropy {astropy.__version__} 中没有：{e}") from e
+    value_size = 1 if dtype.base.kind == 'S' else dtype.base.itemsize
+    if algorithm == 'GZIP_1':
+        raw = Gzip1().decode(compressed)
+    elif algorithm == 'GZIP_2':
+        raw = Gzip2(itemsize=value_size).decode(compressed)
+    elif algorithm == 'RICE_1':
+        values = Rice1(blocksize=RICE_BLOCK_SIZE, bytepix=value_size,
+                       tilesize=n_rows * dtype.itemsize // value_size).decode(compressed)
+        raw = values.astype(f'>i{value_size}').view(np.uint8)
+    elif algorithm == 'NOCOMPRESS':
+        raw = NoCompress().decode(compressed)
+    else:
+        raise ValueError(f"Unsupported table compression algorithm: {algorithm}")
+    return np.asarray(raw, dtype=np.uint8).reshape(n_rows, dtype.itemsize)
+
+def _iter_tile_rows(fits_path):
+    """fpack压缩的表：逐个tile解压各列并拼回原始行，内存只与tile大小有关"""
+    with fits.open(fits_path, memmap=True) as hdul:
+        hdu = hdul[1]
+        header = uncompressed_header(hdu.header)
+        _check_streamable(header, fits_path)
+        yield header
+        fields = fits.BinTableHDU.fromstring(header.tostring().encode('ascii')).columns.dtype.fields
+        total, tile_len = header['NAXIS2'], hdu.header['ZTILELEN']
+        algorithms = {hdu.header[f'TTYPE{i}']: hdu.header[f'ZCTYP{i}']
+                      for i in range(1, hdu.header['TFIELDS'] + 1)}
+        tiles = hdu.data
+        for tile in range(len(tiles)):
+            n_rows = min(tile_len, total - tile * tile_len)
+            rows = np.empty((n_rows, header['NAXIS1']), dtype=np.uint8)
+            for name, (dtype, offset) in fields.items():
+                rows[:, offset:offset + dtype.itemsize] = _decode_tile_column(
+                    tiles.field(name)[tile], algorithms[name], dtype, n_rows)
+            yield rows
+
+def _rebatch(rows_iter, block_size):
+    """把大小不一的行块（如fpack的tile）重新切分为block_size行一块"""
+    pending = []
+    n_pending = 0
+    for rows in rows_iter:
+        pending.append(rows)
+        n_pending += len(rows)
+        while n_pending >= block_size:
+            rows = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield rows[:block_size]
+            n_pending -= block_size
+            pending = [rows[block_size:]] if n_pending else []
+    if n_pending:
+        yield np.concatenate(pending)
+
+def iter_table_blocks(fits_path, block_size, start_row=0):
+    """按块读取星表，产出(起始行, 总行数, FITS_rec块)，从start_row行开始。
+    未压缩文件直接对内存映射切片；压缩文件分块解压，只在内存中保留当前块
+    （start_row之前的块仍需解压，但不会构造成表）"""
+    if not is_stream_compressed(fits_path):
+        with fits.open(fits_path, memmap=True) as hdul:
+            if not is_tile_compressed(hdul[1].header):
+                data = hdul[1].data
+                for start in range(start_row, len(data), block_size):
+                    yield start, len(data), data[start:start + block_size]
+                return
+        rows_iter = _iter_tile_rows(fits_path)
+    else:
+        rows_iter = _iter_stream_rows(fits_path, block_size)
+    header = next(rows_iter)
+    start = 0
+    for rows in _rebatch(rows_iter, block_size):
+        if start >= start_row:
+            yield start, header['NAXIS2'], _rows_to_table(header, rows)
+        start += len(rows)
@@ -0,0 +1,143 @@
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from catalog_store import load_params, write_params
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认匹配半径（角秒），与LAMOST光纤直径（约3.3角秒）相当
+DEFAULT_RADIUS_ARCSEC = 3.0
+
+# 外部星表每块读取的行数
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+def radec_to_xyz(ra, dec):
+    """把ra/dec（度）转换为单位球面上的直角坐标"""
+    ra = np.radians(np.asarray(ra, dtype=np.float64))
+    dec = np.radians(np.asarray(dec, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.column_stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)])
+
+def chord_length(radius_arcsec):
+    """角距离对应的单位球面弦长，KD树在三维空间中按弦长查询"""
+    return 2 * np.sin(np.radians(radius_arcsec / 3600) / 2)
+
+def group_duplicates(ra, dec, radius_arcsec=DEFAULT_RADIUS_ARCSEC):
+    """把角距离在radius_arcsec以内的观测归为同一颗星（按近邻关系传递合并），
+    返回每行的星编号。KD树建树和查询都是O(N log N)"""
+    xyz = radec_to_xyz(ra, dec)
+    n = len(xyz)
+    pairs = cKDTree(xyz).query_pairs(chord_length(radius_arcsec), output_type='ndarray')
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+def best_per_group(groups, score):
+    """每组中score最大的行号（按行号排序）"""
+    order = np.lexsort((-np.asarray(score), groups))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = groups[order][1:] != groups[order][:-1]
+    return np.sort(order[first])
+
+def deduplicate(df, radius_arcsec=DEFAULT_RADIUS_ARCSEC, keep_best_snr=True, snr_col='snrg'):
+    """识别重复观测：添加star_id列；keep_best_snr为True时每颗星只保留SNR最高的一次观测"""
+    groups = group_duplicates(df['ra'].to_numpy(), df['dec'].to_numpy(), radius_arcsec)
+    df = df.assign(star_id=groups)
+    n_stars = groups.max() + 1 if len(groups) else 0
+    logger.info(f"{len(df)}条观测对应{n_stars}颗星（匹配半径{radius_arcsec}角秒）")
+    if keep_best_snr:
+        df = df.iloc[best_per_group(groups, df[snr_col].to_numpy())].reset_index(drop=True)
+    return df
+
+def iter_table_chunks(path, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """分块读取外部星表（Parquet或CSV），内存只与块大小有关"""
+    path = Path(path)
+    if path.suffix == '.parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+
+def match_external(df, external_path, radius_arcsec=DEFAULT_RADIUS_ARCSEC, ra_col='ra', dec_col='dec',
+                   columns=None, prefix='ext_', chunk_size=DEFAULT_CHUNK_SIZE):
+    """把df中的每颗星与外部星表中最近的源匹配（角距离不超过radius_arcsec）。
+    外部星表分块读取：每块建KD树并查询df中所有星的最近邻，与之前各块的最佳结果比较，
+    因此只需保留每颗星当前最近的一个外部源，内存上限与df大小相当。
+    返回匹配上的行，外部星表的列加上prefix前缀，并附加sep_arcsec列"""
+    if columns is not None:
+        columns = list(dict.fromkeys([ra_col, dec_col, *columns]))
+    xyz = radec_to_xyz(df['ra'].to_numpy(), df['dec'].to_numpy())
+    max_chord = chord_length(radius_arcsec)
+    best_chord = np.full(len(df), np.inf)
+    best = None
+    n_external = 0
+    for chunk in iter_table_chunks(external_path, columns, chunk_size):
+        n_external += len(chunk)
+        chunk = chunk.reset_index(drop=True)
+        tree = cKDTree(radec_to_xyz(chunk[ra_col].to_numpy(), chunk[dec_col].to_numpy()))
+        chord, nearest = tree.query(xyz, distance_upper_bound=max_chord)
+        improved = np.flatnonzero(chord < best_chord)
+        if len(improved):
+            best_chord[improved] = chord[improved]
+            candidates = chunk.iloc[nearest[improved]].set_index(improved)
+            best = candidates if best is None else pd.concat(
+                [best.drop(improved, errors='ignore'), candidates])
+        logger.info(f"已匹配外部星表 {n_external} 行，当前匹配上 {np.isfinite(best_chord).sum()} 颗星")
+    if best is None:
+        return df.iloc[:0]
+    best = best.sort_index().add_prefix(prefix)
+    best['sep_arcsec'] = np.degrees(2 * np.arcsin(best_chord[best.index] / 2)) * 3600
+    return df.iloc[best.index].reset_index(drop=True).join(best.reset_index(drop=True))
+
+def main():
+    parser = argparse.ArgumentParser(description='AFG星表的位置交叉匹配')
+    parser.add_argument('--processed-dir', type=Path, default=None,
+                        help='处理后数据目录（默认 data/processed）')
+    sub = parser.add_subparsers(dest='command', required=True)
+    dedup = sub.add_parser('dedup', help='识别同一颗星的重复观测')
+    dedup.add_argument('--radius', type=float, default=DEFAULT_RADIUS_ARCSEC,
+                       help=f'匹配半径（角秒，默认 {DEFAULT_RADIUS_ARCSEC}）')
+    dedup.add_argument('--keep-all', action='store_true',
+                       help='保留全部观测（只添加star_id列），默认每颗星只保留SNR最高的观测')
+    external = sub.add_parser('external', help='与外部星表（Parquet/CSV）按位置交叉匹配')
+    external.add_argument('path', type=Path, help='外部星表文件')
+    external.add_argument('--radius', type=float, default=DEFAULT_RADIUS_ARCSEC,
+                          help=f'匹配半径（角秒，默认 {DEFAULT_RADIUS_ARCSEC}）')
+    external.add_argument('--ra-col', default='ra', help='外部星表的赤经列名')
+    external.add_argument('--dec-col', default='dec', help='外部星表的赤纬列名')
+    external.add_argument('--columns', nargs='+', default=None, help='只读取外部星表的这些列')
+    external.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                          help=f'外部星表每块读取的行数（默认 {DEFAULT_CHUNK_SIZE}）')
+    external.add_argument('--output', type=Path, default=None,
+                          help='输出文件（.csv或.parquet，默认 AFG_xmatch_<外部星表名>.parquet）')
+    args = parser.parse_args()
+
+    processed_dir = args.processed_dir or Path(__file__).parent.parent / 'data' / 'processed'
+    if args.command == 'dedup':
+        df = deduplicate(load_params(processed_dir), args.radius, keep_best_snr=not args.keep_all)
+        params_file = processed_dir / 'AFG_unique_params.csv'
+        df.to_csv(params_file, index=False)
+        write_params(df, processed_dir / 'AFG_unique_params.parquet')
+        logger.info(f"去重后的参数已保存到: {params_file}（{len(df)}条）")
+    elif args.command == 'external':
+        matched = match_external(load_params(processed_dir), args.path, args.radius, args.ra_col,
+                                 args.dec_col, args.columns, chunk_size=args.chunk_size)
+        output = args.output or processed_dir / f'AFG_xmatch_{args.path.name.split(".")[0]}.parquet'
+        if output.suffix == '.parquet':
+            matched.to_parquet(output, index=False)
+        else:
+            matched.to_csv(output, index=False)
+        logger.info(f"匹配上 {len(matched)} 颗星，结果已保存到: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,34 @@
 from astropy.io import fits
+import argparse
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 import pandas as pd
 import numpy as np
 import os
+import shutil
+import tempfile
 from pathlib import Path
 import logging
 
+from catalog_filter import compile_filter
+from catalog_stats import CatalogStats
+from catalog_store import (PARAM_DTYPES, PARTITION_BY, ParamsWriter, PartitionedWriter, append_params,
+                           append_partitions, clear_partitions, cluster_rows, partition_dir, read_params,
+                           remove_params, write_params, write_partitions)
+from compressed_fits import is_compressed_catalog, iter_table_blocks, table_row_count
+from ingest_state import (cache_key, config_hash, in_sorted, load_obsid_index, load_state, merge_obsid_index,
+                          replace_atomically, save_obsid_index, save_state, source_entry)
+from obsid_set import read_obsid_list, save_obsid_set
+from sky_index import DEFAULT_NSIDE, build_sky_index
+
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 输出的基本参数列
+OUTPUT_COLUMNS = ['obsid', 'class', 'subclass', 'snrg', 'teff', 'logg', 'feh', 'ra', 'dec', 'z']
+
 def create_directories(base_path, dirs):
     """创建必要的目录"""
     for d in dirs:
@@ -16,59 +36,647 @@ def create_directories(base_path, dirs):
         path.mkdir(parents=True, exist_ok=True)
         logger.info(f"Created directory: {path}")
 
-def main():
+# 默认筛选条件：恒星、子类型首字母为A/F/G、SNR > 10
+DEFAULT_FILTERS = [
+    ('class', '==', 'STAR'),
+    ('subclass', 'startswith', ('A', 'F', 'G')),
+    ('snrg', '>', 10),
+]
+
+# 流式模式下每块的默认行数
+DEFAULT_BLOCK_SIZE = 500_000
+
+# 可以直接使用原始存储的FITS列格式（无需astropy转换）
+RAW_FORMATS = set('ABIJKED')
+
+def raw_column(data, name):
+    """返回内存映射文件中某列的原始视图（零拷贝，可能是大端字节序）"""
+    column = data.columns[name]
+    if (column.format.format in RAW_FORMATS
+            and column.bscale is None and column.bzero is None):
+        return data.view(np.ndarray)[name]
+    return np.asarray(data.field(name))
+
+def column_to_array(data, name, rows=None):
+    """取出单列（可只取rows指定的行），字符串解码去尾部空格，数值转为本机字节序"""
+    col = raw_column(data, name)
+    if rows is not None:
+        col = col[rows]
+    if col.dtype.kind == 'S':
+        return np.char.decode(np.char.rstrip(col), 'ascii')
+    if col.dtype.kind == 'U':
+        return np.char.rstrip(col)
+    if not col.dtype.isnative:
+        col = col.astype(col.dtype.newbyteorder('='))
+    return col
+
+def normalize_column(values, dtype):
+    """把本机字节序的列转换为紧凑类型：参数为float32，obsid为int64，类型列为categorical"""
+    if dtype is None:
+        return values
+    if dtype == 'category':
+        return pd.Categorical(values)
+    return values.astype(dtype, copy=False)
+
+def catalog_to_frame(data, columns, rows=None, dtypes=PARAM_DTYPES):
+    """按列直接构建DataFrame，内存开销只与所选列数和保留行数成正比；列类型按dtypes规范化"""
+    return pd.DataFrame({name: normalize_column(column_to_array(data, name, rows), dtypes.get(name))
+                         for name in columns})
+
+def normalize_catalog(df, dtypes=PARAM_DTYPES):
+    """对已有DataFrame重新规范化列类型（如合并分块后类型列的categories不一致时）"""
+    return df.astype({name: dtype for name, dtype in dtypes.items() if name in df.columns})
+
+def extracted_row_nbytes(fits_path, columns):
+    """未规范化时每行占用的字节数：数值列为FITS原始宽度，字符串列为定长Unicode"""
+    blocks = iter_table_blocks(fits_path, 1)
+    try:
+        _, _, data = next(blocks)
+    finally:
+        blocks.close()
+    nbytes = 0
+    for name in columns:
+        dtype = raw_column(data, name).dtype
+        nbytes += dtype.itemsize * 4 if dtype.kind == 'S' else dtype.itemsize
+    return nbytes
+
+def log_memory_savings(df, fits_path, columns=OUTPUT_COLUMNS):
+    """报告规范化列类型节省的内存"""
+    if len(df) == 0:
+        return
+    before = extracted_row_nbytes(fits_path, columns) * len(df)
+    after = int(df[columns].memory_usage(index=False, deep=True).sum())
+    logger.info(f"内存占用: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB"
+                f"（规范化列类型节省 {(1 - after / before):.1%}）")
+
+def _match_value(col, value):
+    """把比较值转换为与列一致的类型（字节串列需要编码）"""
+    if isinstance(value, (list, tuple, set)):
+        return [_match_value(col, v) for v in value]
+    if col.dtype.kind == 'S' and isinstance(value, str):
+        return value.encode('ascii')
+    return value
+
+def _strip(col):
+    return np.char.rstrip(col) if col.dtype.kind in 'SU' else col
+
+def _startswith(col, prefixes):
+    """前缀匹配：按前缀长度截断后直接比较，比逐元素startswith快得多"""
+    if not isinstance(prefixes, list):
+        prefixes = [prefixes]
+    mask = np.zeros(len(col), dtype=bool)
+    for prefix in prefixes:
+        mask |= col.astype(f'{col.dtype.kind}{len(prefix)}') == prefix
+    return mask
+
+# 支持的谓词运算符：(列, 值) -> 布尔掩码
+PREDICATE_OPS = {
+    '==': lambda col, value: _strip(col) == value,
+    '!=': lambda col, value: _strip(col) != value,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    'in': lambda col, values: np.isin(_strip(col), values),
+    'startswith': _startswith,
+}
+
+def build_mask(data, filters, exclude=None):
+    """直接在内存映射的FITS列上计算筛选掩码。
+    filters可以是(列名, 运算符, 值)列表，也可以是筛选表达式字符串（见catalog_filter）；
+    exclude为有序obsid数组时，排除其中已有的obsid（多文件合并时去重）"""
+    mask = np.ones(len(data), dtype=bool)
+    if exclude is not None and len(exclude):
+        mask &= ~in_sorted(raw_column(data, 'obsid'), exclude)
+    if isinstance(filters, str):
+        mask &= compile_filter(filters)(lambda name: raw_column(data, name))
+        return mask
+    for name, op, value in filters:
+        if op not in PREDICATE_OPS:
+            raise ValueError(f"Unsupported predicate operator: {op}")
+        col = raw_column(data, name)
+        mask &= PREDICATE_OPS[op](col, _match_value(col, value))
+    return mask
+
+def read_catalog(fits_path, columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS, exclude=None,
+                 return_obsids=False):
+    """读取星表：先只用筛选列计算掩码，再只对保留下来的行取输出列。
+    return_obsids为True时同时返回本文件全部obsid（有序去重），不需要再读一遍文件"""
+    if is_compressed_catalog(fits_path):
+        # 压缩星表不能内存映射，逐块解压筛选后合并
+        frames, obsids = [], []
+        for _, frame, block_obsids in _filtered_blocks(fits_path, columns, filters, DEFAULT_BLOCK_SIZE, exclude):
+            frames.append(frame)
+            obsids.append(block_obsids)
+        merged = normalize_catalog(pd.concat(frames, ignore_index=True))
+        return (merged, merge_obsids(obsids)) if return_obsids else merged
+    with fits.open(fits_path, memmap=True) as hdul:
+        data = hdul[1].data
+        logger.info(f"Total spectra in catalog: {len(data)}")
+        rows = np.flatnonzero(build_mask(data, filters, exclude))
+        frame = catalog_to_frame(data, columns, rows)
+        if return_obsids:
+            return frame, np.unique(column_to_array(data, 'obsid'))
+        return frame
+
+def read_new_rows(fits_path, obsid_index, columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS):
+    """增量读取：只对obsid不在已处理索引中的行计算筛选掩码并取出，返回(新增结果, 本文件全部obsid)"""
+    if is_compressed_catalog(fits_path):
+        # 压缩星表只解压一遍：筛选的同时取出全部obsid
+        added, obsids = read_catalog(fits_path, columns, filters, obsid_index, return_obsids=True)
+        logger.info(f"新增obsid数量: {np.count_nonzero(~in_sorted(obsids, obsid_index))}/{len(obsids)}")
+        return added, obsids
+    with fits.open(fits_path, memmap=True) as hdul:
+        data = hdul[1].data
+        obsids = column_to_array(data, 'obsid')
+        new_rows = np.flatnonzero(~in_sorted(obsids, obsid_index))
+        logger.info(f"新增obsid数量: {len(new_rows)}/{len(data)}")
+        new_data = data[new_rows]
+        rows = np.flatnonzero(build_mask(new_data, filters))
+        return catalog_to_frame(new_data, columns, rows), obsids
+
+def catalog_row_count(fits_path):
+    """只读取表头获取星表行数"""
+    return table_row_count(fits_path)
+
+def _scan_range(task):
+    """子进程任务：打开内存映射文件，筛选[start, stop)范围内的行，
+    并顺便计算该范围的统计量、取出该范围的全部obsid（有序去重）"""
+    fits_path, start, stop, columns, filters, exclude = task
+    with fits.open(fits_path, memmap=True) as hdul:
+        block = hdul[1].data[start:stop]
+        rows = np.flatnonzero(build_mask(block, filters, exclude))
+        frame = catalog_to_frame(block, columns, rows)
+        obsids = np.unique(column_to_array(block, 'obsid'))
+    return frame, CatalogStats().update(frame), obsids
+
+def read_catalog_parallel(fits_path, columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS, exclude=None,
+                          workers=None, block_size=DEFAULT_BLOCK_SIZE, return_stats=False, return_obsids=False):
+    """多进程读取星表：按行范围切分，由进程池分别筛选，再按行范围的顺序合并（与单进程读取的结果相同）。
+    return_stats为True时同时返回各进程统计量合并后的CatalogStats，
+    return_obsids为True时再返回本文件全部obsid（有序去重）"""
+    if is_compressed_catalog(fits_path):
+        # 压缩星表只能顺序解压，不能按行范围并行读取
+        logger.warning(f"{fits_path} 是压缩文件，改为单进程分块读取")
+        merged, obsids = read_catalog(fits_path, columns, filters, exclude, return_obsids=True)
+        result = (merged,) + ((CatalogStats().update(merged),) if return_stats else ()) \
+            + ((obsids,) if return_obsids else ())
+        return result if len(result) > 1 else merged
+    total = catalog_row_count(fits_path)
+    logger.info(f"Total spectra in catalog: {total}")
+    tasks = [(fits_path, start, min(start + block_size, total), columns, filters, exclude)
+             for start in range(0, total, block_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts, part_stats, part_obsids = zip(*pool.map(_scan_range, tasks))
+    # 各范围的类型列categories不同，合并后需要重新规范化
+    merged = normalize_catalog(pd.concat(parts, ignore_index=True))
+    result = (merged,) + ((CatalogStats.combine(part_stats),) if return_stats else ()) \
+        + ((merge_obsids(part_obsids),) if return_obsids else ())
+    return result if len(result) > 1 else merged
+
+def _filtered_blocks(fits_path, columns, filters, block_size, exclude=None, start_row=0):
+    """逐块筛选，产出(该块之后的下一行, 筛选结果, 该块全部obsid（有序去重）)"""
+    for start, total, block in iter_table_blocks(fits_path, block_size, start_row):
+        if start == start_row:
+            logger.info(f"Total spectra in catalog: {total}")
+        rows = np.flatnonzero(build_mask(block, filters, exclude))
+        obsids = np.unique(column_to_array(block, 'obsid'))
+        yield start + len(block), catalog_to_frame(block, columns, rows), obsids
+        logger.info(f"已处理 {start + len(block)}/{total} 行")
+
+def iter_catalog_blocks(fits_path, columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS,
+                        block_size=DEFAULT_BLOCK_SIZE, exclude=None):
+    """按固定行数分块遍历星表，逐块筛选并产出DataFrame，峰值内存只取决于块大小。
+    gzip/bzip2或fpack压缩的星表边解压边处理，不需要先解压整个文件"""
+    for _, frame, _ in _filtered_blocks(fits_path, columns, filters, block_size, exclude):
+        yield frame
+
+def merge_obsids(arrays):
+    """合并若干有序去重的obsid数组"""
+    arrays = list(arrays)
+    if not arrays:
+        return np.empty(0, dtype=np.int64)
+    return arrays[0] if len(arrays) == 1 else np.unique(np.concatenate(arrays))
+
+def iter_catalogs_blocks(fits_paths, columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS,
+                         block_size=DEFAULT_BLOCK_SIZE, index_file=None):
+    """依次分块遍历多个星表文件，后面文件中与前面文件重复的obsid会被跳过。
+    扫描过的obsid逐块并入index_file中重建的有序索引，不保存在内存里；index_file为None时使用临时文件"""
+    with ExitStack() as stack:
+        if index_file is None:
+            index_file = Path(stack.enter_context(tempfile.TemporaryDirectory())) / 'obsids.npy'
+        save_obsid_index(np.empty(0, dtype=np.int64), index_file)
+        for fits_path in fits_paths:
+            # 去重只需要前面文件的obsid：映射文件开始时的索引，本文件各块并入的是替换后的新文件
+            seen = load_obsid_index(index_file, mmap=True)
+            for _, frame, obsids in _filtered_blocks(fits_path, columns, filters, block_size, seen):
+                merge_obsid_index(obsids, index_file)
+                yield frame
+
+def stream_catalog(fits_paths, obsid_file, params_file=None, parquet_file=None,
+                   columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS, block_size=DEFAULT_BLOCK_SIZE,
+                   partitions=None, index_file=None):
+    """流式筛选：依次逐块处理各星表文件，追加写出obsid列表、参数文件（CSV/Parquet）
+    和分区文件（partitions为(目录, 分区方式)）。
+    后面文件中与前面文件重复的obsid会被跳过；index_file见iter_catalogs_blocks。返回值同write_blocks"""
+    blocks = iter_catalogs_blocks(fits_paths, columns, filters, block_size, index_file)
+    return write_blocks(blocks, obsid_file, params_file, parquet_file, columns, partitions)
+
+def write_blocks(blocks, obsid_file, params_file=None, parquet_file=None, columns=OUTPUT_COLUMNS,
+                 partitions=None):
+    """把逐块产出的筛选结果依次追加写出（obsid列表和CSV保持星表顺序，Parquet和分区文件每块按天区和
+    有效温度聚类），返回保留行数、各子类型计数和逐块累加的统计量"""
+    n_rows = 0
+    stats = CatalogStats()
+    subclass_counts = pd.Series(dtype='int64')
+    with ExitStack() as stack:
+        f_obsid = stack.enter_context(open(obsid_file, 'w', newline=''))
+        f_params = None
+        if params_file is not None:
+            f_params = stack.enter_context(open(params_file, 'w', newline=''))
+            f_params.write(','.join(columns) + '\n')
+        writers = []
+        if parquet_file is not None:
+            writers.append(stack.enter_context(ParamsWriter(parquet_file, columns)))
+        if partitions is not None:
+            writers.append(stack.enter_context(PartitionedWriter(*partitions, columns)))
+        for block in blocks:
+            block['obsid'].to_csv(f_obsid, index=False, header=False)
+            if f_params is not None:
+                block[columns].to_csv(f_params, index=False, header=False)
+            if writers:
+                clustered = cluster_rows(block[columns])
+                for writer in writers:
+                    writer.write(clustered)
+            n_rows += len(block)
+            subclass_counts = subclass_counts.add(block['subclass'].value_counts(), fill_value=0)
+            stats.update(block)
+    return n_rows, subclass_counts.astype('int64').sort_values(ascending=False), stats
+
+def checkpointed_parts(fits_paths, parts_dir, checkpoint_file, run_key, columns=OUTPUT_COLUMNS,
+                       filters=DEFAULT_FILTERS, block_size=DEFAULT_BLOCK_SIZE):
+    """可恢复的分块筛选：每块的筛选结果写成单独的Parquet分片，分片写完后原子更新检查点
+    （当前文件、下一行和分片数）。中断后用相同的run_key重新运行时，从最后提交的块之后继续；
+    run_key不同（星表或配置已变化）时丢弃旧的分片重新开始。
+    每块扫描过的obsid逐块并入分片目录中的有序索引，恢复后不需要重新读取已处理的部分。
+    返回按顺序排列的分片路径和建好的obsid索引文件的路径"""
+    parts_dir = Path(parts_dir)
+    index_file = parts_dir / 'obsids.npy'
+    checkpoint = load_state(checkpoint_file)
+    if checkpoint.get('run_key') != run_key or not index_file.exists():
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        checkpoint = {'run_key': run_key, 'file': 0, 'row': 0, 'parts': 0}
+        parts_dir.mkdir(parents=True)
+        save_obsid_index(np.empty(0, dtype=np.int64), index_file)
+    elif checkpoint['file'] or checkpoint['row']:
+        logger.info(f"从检查点恢复：第 {checkpoint['file'] + 1} 个星表文件的第 {checkpoint['row']} 行，"
+                    f"已有 {checkpoint['parts']} 个分片")
+    # 跨文件去重只用已处理完的文件的obsid：每个文件处理完后把索引另存为seen-<下一个文件序号>.npy。
+    # 索引里可能多出中断前未提交的块的obsid，重新处理这些块时并入同样的值，不影响结果
+    seen = load_obsid_index(parts_dir / f"seen-{checkpoint['file']:06d}.npy", mmap=True)
+    for file_index in range(checkpoint['file'], len(fits_paths)):
+        fits_path = fits_paths[file_index]
+        blocks = _filtered_blocks(fits_path, columns, filters, block_size, seen, checkpoint['row'])
+        for next_row, frame, obsids in blocks:
+            if len(frame):
+                part = parts_dir / f"part-{checkpoint['parts']:06d}.parquet"
+                replace_atomically(part, lambda tmp_path: write_params(frame, tmp_path, zones=False))
+                checkpoint['parts'] += 1
+            merge_obsid_index(obsids, index_file)
+            checkpoint['row'] = next_row
+            save_state(checkpoint, checkpoint_file)
+        if file_index < len(fits_paths) - 1:
+            next_seen = parts_dir / f'seen-{file_index + 1:06d}.npy'
+            replace_atomically(next_seen, lambda tmp_path: shutil.copyfile(index_file, tmp_path))
+            seen = load_obsid_index(next_seen, mmap=True)
+        checkpoint.update(file=file_index + 1, row=0)
+        save_state(checkpoint, checkpoint_file)
+        (parts_dir / f'seen-{file_index:06d}.npy').unlink(missing_ok=True)
+    return [parts_dir / f'part-{i:06d}.parquet' for i in range(checkpoint['parts'])], index_file
+
+def clear_checkpoint(parts_dir, checkpoint_file):
+    """全部输出写完后删除分片和检查点"""
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    Path(checkpoint_file).unlink(missing_ok=True)
+
+def expand_catalog_paths(patterns):
+    """展开星表文件列表，支持通配符（同一通配符匹配的文件按文件名排序）"""
+    paths = []
+    for pattern in patterns:
+        pattern = str(pattern)
+        if glob.has_magic(pattern):
+            matched = sorted(glob.glob(pattern))
+            if not matched:
+                raise FileNotFoundError(pattern)
+            paths.extend(Path(p) for p in matched)
+        else:
+            paths.append(Path(pattern))
+    # 同一文件只处理一次
+    return list(dict.fromkeys(paths))
+
+def read_catalogs(fits_paths, columns=OUTPUT_COLUMNS, filters=DEFAULT_FILTERS, workers=1,
+                  block_size=DEFAULT_BLOCK_SIZE):
+    """依次读取多个星表文件并合并，后面文件中与前面文件重复的obsid会被跳过。
+    返回(合并结果, 统计量, 所有文件中的obsid)"""
+    parts, part_stats = [], []
+    seen = np.empty(0, dtype=np.int64)
+    for fits_path in fits_paths:
+        if workers > 1:
+            part, stats, obsids = read_catalog_parallel(fits_path, columns, filters, seen, workers=workers,
+                                                        block_size=block_size, return_stats=True,
+                                                        return_obsids=True)
+        else:
+            part, obsids = read_catalog(fits_path, columns, filters, seen, return_obsids=True)
+            stats = CatalogStats().update(part)
+        parts.append(part)
+        part_stats.append(stats)
+        seen = merge_obsids([seen, obsids]) if len(seen) else obsids
+    merged = parts[0] if len(parts) == 1 else normalize_catalog(pd.concat(parts, ignore_index=True))
+    return merged, CatalogStats.combine(part_stats), seen
+
+def save_outputs(filtered, obsid_file, params_file=None, parquet_file=None, append=False,
+                 partitions=None):
+    """保存（或在增量模式下追加）obsid列表、参数文件和分区文件（partitions为(目录, 分区方式)）。
+    obsid列表和CSV按filtered的顺序写出，Parquet和分区文件先按天区和有效温度聚类"""
+    mode = 'a' if append else 'w'
+    filtered['obsid'].to_csv(obsid_file, mode=mode, index=False, header=False)
+    logger.info(f"筛选后的obsid列表已保存到: {obsid_file}")
+    if params_file is not None:
+        filtered[OUTPUT_COLUMNS].to_csv(params_file, mode=mode, index=False, header=not append)
+        logger.info(f"基本参数已保存到: {params_file}")
+    if parquet_file is None and partitions is None:
+        return
+    clustered = cluster_rows(filtered[OUTPUT_COLUMNS])
+    if parquet_file is not None:
+        if append:
+            append_params(clustered, parquet_file)
+        else:
+            write_params(clustered, parquet_file)
+        logger.info(f"基本参数已保存到: {parquet_file}")
+    if partitions is not None:
+        if append:
+            append_partitions(clustered, *partitions)
+        else:
+            write_partitions(clustered, *partitions)
+        logger.info(f"按{partitions[1]}分区的参数已保存到: {partitions[0]}")
+
+def invalidate_ingested(index_file, state_file):
+    """开始改写输出之前删除obsid索引，并从状态中去掉缓存键和配置。
+    中途失败时下次运行不会把写了一半的输出当成最新的，也不会在它上面增量追加"""
+    index_file.unlink(missing_ok=True)
+    state = load_state(state_file)
+    if 'cache_key' in state or 'config' in state:
+        state.pop('cache_key', None)
+        state.pop('config', None)
+        save_state(state, state_file)
+
+def record_ingested(index_file, state_file, sources, obsids, key, config_id, reset=False):
+    """所有输出都写完后保存obsid索引，并记录源文件指纹、缓存键和配置，供下次缓存判断和增量处理使用。
+    obsids为已处理的全部obsid，或逐块建好的索引文件的路径（移动为index_file）。
+    reset为True时丢弃之前记录的源文件"""
+    if isinstance(obsids, Path):
+        os.replace(obsids, index_file)
+    else:
+        save_obsid_index(obsids, index_file)
+    state = {} if reset else load_state(state_file)
+    state.setdefault('sources', {}).update(sources)
+    state['cache_key'] = key
+    state['config'] = config_id
+    save_state(state, state_file)
+
+def written_positions(params_file, parquet_file):
+    """从本次写出（或追加）的参数文件读取全部行的ra/dec。两种格式都写出时读取Parquet，
+    与load_params一致（Parquet的行已聚类，顺序与CSV不同）"""
+    if parquet_file is not None:
+        df = read_params(parquet_file, columns=['ra', 'dec'])
+    else:
+        df = pd.read_csv(params_file, usecols=['ra', 'dec'], dtype=PARAM_DTYPES)
+    return df['ra'].to_numpy(), df['dec'].to_numpy()
+
+def write_sky_index(path, nside, ra, dec):
+    """为本次写出的参数文件建立天区索引，ra/dec必须与参数文件逐行对应"""
+    if path is None:
+        return
+    build_sky_index(ra, dec, path, nside)
+
+def remove_unwritten_formats(processed_dir, params_file, parquet_file):
+    """删除本次不写出的参数表格式。load_params优先读取Parquet，
+    留下上一次运行的旧文件会让下游读到与本次输出不一致的数据"""
+    if params_file is None:
+        stale = Path(processed_dir) / 'AFG_params.csv'
+        if stale.exists():
+            logger.info(f"本次不输出CSV，删除旧的参数文件: {stale}")
+            stale.unlink()
+    if parquet_file is None:
+        stale = Path(processed_dir) / 'AFG_params.parquet'
+        if stale.exists():
+            logger.info(f"本次不输出Parquet，删除旧的参数文件: {stale}")
+        remove_params(stale)
+
+def remove_unwritten_partitions(processed_dir, partition_by):
+    """清空本次不写出的分区目录：下游按清单是否存在决定是否按分区读取，
+    旧的清单会让它们读到上一次运行的分区"""
+    for by in PARTITION_BY:
+        directory = partition_dir(processed_dir, by)
+        if by != partition_by and (directory / 'manifest.json').exists():
+            logger.info(f"本次不按{by}分区，删除旧的分区文件: {directory}")
+            clear_partitions(directory)
+
+def write_obsid_set(path, obsid_file):
+    """把输出的obsid列表另存为有序的二进制集合"""
+    obsids = save_obsid_set(read_obsid_list(obsid_file), path)
+    logger.info(f"obsid集合（{len(obsids)}个）已保存到: {path}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='从LAMOST星表中筛选A/F/G型恒星')
+    parser.add_argument('--fits', nargs='+', default=None,
+                        help='一个或多个星表FITS文件，支持通配符；重复的obsid只保留最先出现的一条'
+                             '（默认 data/raw/dr10_v0_LRS_stellar_q1q2q3.fits）')
+    parser.add_argument('--output-dir', type=Path, default=None,
+                        help='输出目录（默认 data/processed）')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'both'], default='both',
+                        help='参数表输出格式（默认同时输出CSV和Parquet）')
+    parser.add_argument('--filter', default=None,
+                        help="筛选表达式，例如 \"class == 'STAR' and subclass[0] in 'AFG' and snrg > 10 "
+                             "and teff < 8000\"（默认为A/F/G型且SNR > 10）")
+    parser.add_argument('--stream', action='store_true',
+                        help='分块流式处理，筛选和写出的内存由 --block-size 决定而不是星表大小，obsid索引逐块合并到磁盘上；'
+                             '最后建立天区索引和obsid集合时仍要读入全部行的ra/dec和obsid（每行约24字节）')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='可恢复的流式处理：每块结果提交后记录检查点，中断后用相同参数重新运行即从断点继续'
+                             '（隐含 --stream）')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f'流式/并行模式下每块的行数（默认 {DEFAULT_BLOCK_SIZE}）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行筛选的进程数，大于1时按行范围分块并行扫描（不能与 --stream 同时使用）')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量模式：只处理obsid索引中没有的新行，并追加到已有输出')
+    parser.add_argument('--partition-by', choices=[*PARTITION_BY, 'none'], default='type',
+                        help='另外按光谱类型或subclass分区写出Parquet参数表和清单（默认type，none表示不分区）')
+    parser.add_argument('--nside', type=int, default=DEFAULT_NSIDE,
+                        help=f'天区索引的HEALPix nside（默认 {DEFAULT_NSIDE}，0表示不建立索引）')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略缓存，即使星表和筛选配置都未变化也重新处理；'
+                             '与 --incremental 同时使用时，没有变化的星表文件也重新扫描新增的obsid')
+    args = parser.parse_args(argv)
+    if args.filter is not None:
+        try:
+            compile_filter(args.filter)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.checkpoint:
+        args.stream = True
+    if args.stream and args.workers > 1:
+        parser.error('--workers 不能与 --stream 同时使用')
+    if args.incremental and (args.stream or args.workers > 1):
+        parser.error('--incremental 不能与 --stream 或 --workers 同时使用')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # 设置路径
     base_dir = Path(__file__).parent.parent
     data_dir = base_dir / 'data'
-    processed_dir = data_dir / 'processed'
+    processed_dir = args.output_dir or data_dir / 'processed'
     
     # 创建保存目录
-    create_directories(data_dir, ['processed'])
+    create_directories(processed_dir.parent, [processed_dir.name])
     
     # 读取FITS文件
     logger.info("Reading FITS file...")
-    fits_path = data_dir / 'raw' / 'dr10_v0_LRS_stellar_q1q2q3.fits'
+    fits_patterns = args.fits or [data_dir / 'raw' / 'dr10_v0_LRS_stellar_q1q2q3.fits']
+    obsid_file = processed_dir / 'AFG_obsid.txt'
+    # 同一obsid列表的有序二进制集合（.npy），供下游做成员判断和集合运算
+    obsid_set_file = processed_dir / 'AFG_obsid.npy'
+    params_file = processed_dir / 'AFG_params.csv' if args.format != 'parquet' else None
+    parquet_file = processed_dir / 'AFG_params.parquet' if args.format != 'csv' else None
+    # 已处理obsid的有序索引和源文件指纹，供增量模式使用
+    index_file = processed_dir / 'AFG_obsid_index.npy'
+    state_file = processed_dir / 'AFG_ingest_state.json'
+    # 按HEALPix像素排序的天区索引，行号对应参数文件中的行
+    sky_index_file = processed_dir / 'AFG_healpix_index.npz' if args.nside > 0 else None
+    # 可恢复流式处理的检查点和已提交的分块结果
+    checkpoint_file = processed_dir / 'AFG_ingest_checkpoint.json'
+    parts_dir = processed_dir / 'AFG_ingest_parts'
+    # 按光谱类型（或subclass）分区的参数表，下游按需只读取需要的分区
+    partitions = None
+    if args.partition_by != 'none':
+        partitions = (partition_dir(processed_dir, args.partition_by), args.partition_by)
+    
+    # 处理配置：输出列与筛选条件，连同星表内容哈希一起构成缓存键
+    filters = args.filter or DEFAULT_FILTERS
+    config = {'columns': OUTPUT_COLUMNS, 'filters': filters}
+    config_id = config_hash(config)
     
     try:
-        with fits.open(fits_path) as hdul:
-            data = hdul[1].data
-            logger.info(f"Total spectra in catalog: {len(data)}")
-            
-            # 转换为DataFrame
-            df = pd.DataFrame(data.tolist(), columns=data.names)
-            
-            # 筛选A/F/G型星且SNR > 10的目标
-            filtered = df[
-                (df['class'] == 'STAR') &  # 确保是恒星
-                (df['subclass'].str[0].isin(['A', 'F', 'G'])) &  # 匹配首字母为A、F、G的子类型
-                (df['snrg'] > 10)
-            ]
-            
-            logger.info(f"筛选后的光谱数量: {len(filtered)}")
+        fits_paths = expand_catalog_paths(fits_patterns)
+        logger.info(f"星表文件: {', '.join(str(path) for path in fits_paths)}")
+        state = load_state(state_file)
+        sources = {str(path.resolve()): source_entry(path, state.get('sources', {}))
+                   for path in fits_paths}
+        key = cache_key(sources, {**config, 'format': args.format, 'nside': args.nside,
+                                           'partition_by': args.partition_by})
+        outputs = [index_file, obsid_file, obsid_set_file, params_file, parquet_file, sky_index_file,
+                   partitions and partitions[0] / 'manifest.json']
+        outputs_exist = all(path.exists() for path in outputs if path is not None)
+        if not args.force and outputs_exist and state.get('cache_key') == key and not checkpoint_file.exists():
+            logger.info("处理结果已是最新（星表内容和筛选配置都没有变化），跳过")
+            return
+        incremental = args.incremental and outputs_exist and state.get('config') == config_id
+        index = load_obsid_index(index_file) if incremental else None
+        invalidate_ingested(index_file, state_file)
+        remove_unwritten_formats(processed_dir, params_file, parquet_file)
+        remove_unwritten_partitions(processed_dir, args.partition_by)
+        if sky_index_file is None:
+            (processed_dir / 'AFG_healpix_index.npz').unlink(missing_ok=True)
+        
+        if incremental:
+            # 增量模式：跳过没有变化的文件，其余文件只处理新的obsid并追加到已有输出
+            added_parts = []
+            for path in fits_paths:
+                source = str(path.resolve())
+                if not args.force and state.get('sources', {}).get(source) == sources[source]:
+                    logger.info(f"{path} 自上次处理后没有变化，跳过")
+                    continue
+                added, obsids = read_new_rows(path, index, OUTPUT_COLUMNS, filters)
+                added_parts.append(added)
+                index = np.union1d(index, obsids)
+            if not added_parts:
+                logger.info("所有星表文件都没有变化，没有需要追加的数据")
+                if state.get('cache_key') != key:
+                    # 星表没变但输出设置（如nside）变了：只重建由参数文件派生的输出
+                    logger.info("输出设置已变化，按新的设置重建派生的输出")
+                    write_sky_index(sky_index_file, args.nside, *written_positions(params_file, parquet_file))
+                record_ingested(index_file, state_file, sources, index, key, config_id)
+                return
+            added = normalize_catalog(pd.concat(added_parts, ignore_index=True))
+            logger.info(f"新增筛选后的光谱数量: {len(added)}")
+            save_outputs(added, obsid_file, params_file, parquet_file, append=True, partitions=partitions)
+            write_sky_index(sky_index_file, args.nside, *written_positions(params_file, parquet_file))
+            write_obsid_set(obsid_set_file, obsid_file)
+            record_ingested(index_file, state_file, sources, index, key, config_id)
+            return
+        if args.incremental:
+            logger.info("没有可增量更新的已有输出（或筛选配置已变化），执行完整处理")
+        
+        if args.stream:
+            if args.checkpoint:
+                # 可恢复模式：先逐块提交分片，全部完成后再由分片依次写出各输出文件
+                run_key = config_hash({'cache_key': key, 'block_size': args.block_size})
+                parts, all_obsids = checkpointed_parts(fits_paths, parts_dir, checkpoint_file, run_key,
+                                                       OUTPUT_COLUMNS, filters, args.block_size)
+                n_rows, subclass_counts, stats = write_blocks(
+                    (read_params(part) for part in parts), obsid_file, params_file, parquet_file,
+                    OUTPUT_COLUMNS, partitions)
+            else:
+                # 流式模式：逐块筛选并追加写出，扫描过的obsid逐块并入磁盘上重建的obsid索引
+                n_rows, subclass_counts, stats = stream_catalog(
+                    fits_paths, obsid_file, params_file, parquet_file, OUTPUT_COLUMNS, filters,
+                    args.block_size, partitions, index_file)
+                all_obsids = index_file
+            logger.info(f"筛选后的光谱数量: {n_rows}")
             logger.info("\n各光谱类型数量:")
-            logger.info("\n" + str(filtered['subclass'].value_counts().head(10)))
-            
-            # 保存obsid列表
-            obsid_file = processed_dir / 'AFG_obsid.txt'
-            filtered['obsid'].to_csv(obsid_file, index=False, header=False)
+            logger.info("\n" + str(subclass_counts.head(10)))
             logger.info(f"筛选后的obsid列表已保存到: {obsid_file}")
-            
-            # 保存基本参数
-            params_file = processed_dir / 'AFG_params.csv'
-            columns = ['obsid', 'class', 'subclass', 'snrg', 'teff', 'logg', 'feh', 'ra', 'dec', 'z']
-            filtered[columns].to_csv(params_file, index=False)
-            logger.info(f"基本参数已保存到: {params_file}")
-            
-            # 输出一些统计信息
+            for path in (params_file, parquet_file):
+                if path is not None:
+                    logger.info(f"基本参数已保存到: {path}")
+            if partitions is not None:
+                logger.info(f"按{args.partition_by}分区的参数已保存到: {partitions[0]}")
+            write_sky_index(sky_index_file, args.nside, *written_positions(params_file, parquet_file))
+            write_obsid_set(obsid_set_file, obsid_file)
+            record_ingested(index_file, state_file, sources, all_obsids, key, config_id, reset=True)
+            if args.checkpoint:
+                clear_checkpoint(parts_dir, checkpoint_file)
             logger.info("\n基本参数统计:")
-            stats = filtered[['teff', 'logg', 'feh', 'snrg']].describe()
-            logger.info("\n" + str(stats))
-            
-    except FileNotFoundError:
-        logger.error(f"Error: Could not find file {fits_path}")
+            logger.info("\n" + str(stats.describe()))
+            return
+        
+        # 列裁剪+谓词下推：只有通过筛选的行才会被取出
+        filtered, stats, all_obsids = read_catalogs(fits_paths, OUTPUT_COLUMNS, filters,
+                                                    args.workers, args.block_size)
+        log_memory_savings(filtered, fits_paths[0])
+        logger.info(f"筛选后的光谱数量: {len(filtered)}")
+        logger.info("\n各光谱类型数量:")
+        logger.info("\n" + str(filtered['subclass'].value_counts().head(10)))
+        
+        # 保存obsid列表和基本参数（Parquet按天区和有效温度聚类，zone map才能跳过row group）
+        save_outputs(filtered, obsid_file, params_file, parquet_file, partitions=partitions)
+        write_sky_index(sky_index_file, args.nside, *written_positions(params_file, parquet_file))
+        write_obsid_set(obsid_set_file, obsid_file)
+        # 完整处理后重建obsid索引，之后可以增量运行
+        record_ingested(index_file, state_file, sources, all_obsids, key, config_id, reset=True)
+        
+        # 输出一些统计信息
+        logger.info("\n基本参数统计:")
+        logger.info("\n" + str(stats.describe()))
+        
+    except FileNotFoundError as e:
+        logger.error(f"Error: Could not find file {e.filename or e}")
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,32 +1,354 @@
+import argparse
+import hashlib
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import logging
+from scipy.spatial import cKDTree
+
+from catalog_stats import CatalogStats
+from catalog_store import (DEFAULT_CHUNK_SIZE, MISSING_PARTITION, iter_params, iter_partitions, load_manifest,
+                           load_params)
+from crossmatch import deduplicate
+from obsid_set import load_obsid_set, save_obsid_set
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def sample_by_type(df, type_col, n_samples=1000):
-    """从每个类型中随机抽取n_samples条数据，并返回每种类型的数据和合并后的数据"""
-    # 获取所有类型
-    types = df[type_col].str[0].unique()
+# 抽样分组方式：按光谱类型（subclass首字母）或按subclass
+GROUP_BY = ('type', 'subclass')
+
+def group_codes(df, type_col, by='type'):
+    """每行所属分组的整数编码和各分组名，分组按首次出现的顺序编号。
+    subclass缺失或为空的行编码为-1，不属于任何分组。字符串运算只对类别做一次，不随分组数增加"""
+    col = df[type_col].astype('category')
+    categories = col.cat.categories.astype(str)
+    names = (categories.str[0] if by == 'type' else categories).fillna('').to_numpy(dtype=object)
+    groups, inverse = np.unique(names, return_inverse=True)
+    # 空的分组名与缺失值一样编码为-1
+    lookup = np.full(len(groups), -1, dtype=np.intp)
+    keep = groups != ''
+    lookup[keep] = np.arange(np.count_nonzero(keep))
+    groups = groups[keep]
+    cat_codes = col.cat.codes.to_numpy()
+    codes = np.full(len(cat_codes), -1, dtype=np.intp)
+    valid = cat_codes >= 0
+    codes[valid] = lookup[inverse.ravel()[cat_codes[valid]]]
+    # 按首次出现的顺序重新编号，没有出现的分组不返回
+    valid = codes >= 0
+    present, first = np.unique(codes[valid], return_index=True)
+    order = present[np.argsort(first)]
+    remap = np.full(len(groups), -1, dtype=np.intp)
+    remap[order] = np.arange(len(order))
+    codes[valid] = remap[codes[valid]]
+    return codes, groups[order]
+
+def group_slices(codes, n_groups):
+    """按分组稳定排序后的行位置和每组的起止位置，第i组是order[bounds[i]:bounds[i + 1]]。
+    编码为-1的行不包含在内；稳定排序保持组内原有的行顺序"""
+    rows = np.flatnonzero(codes >= 0)
+    order = rows[np.argsort(codes[rows], kind='stable')]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes[rows], minlength=n_groups))])
+    return order, bounds
+
+def sample_positions(size, n_samples, seed=42):
+    """从size行中无放回抽取n_samples行的位置，与DataFrame.sample(random_state=seed)相同"""
+    return np.random.RandomState(seed).permutation(size)[:min(n_samples, size)]
+
+def sample_by_type(df, type_col, n_samples=1000, by='type', seed=42):
+    """从每个类型（by='subclass'时为每个subclass）中随机抽取n_samples条数据，
+    并返回每种类型的数据和合并后的数据。
+    分组编码只计算一次，一次稳定排序后每组都是连续的一段，按组切片抽样"""
+    codes, groups = group_codes(df, type_col, by)
+    order, bounds = group_slices(codes, len(groups))
     sampled_data = {}
-    
-    for star_type in types:
-        # 获取该类型的所有数据
-        type_data = df[df[type_col].str[0] == star_type]
-        # 计算实际可以抽取的样本数（取最小值）
-        actual_samples = min(n_samples, len(type_data))
-        # 随机抽样
-        sampled = type_data.sample(n=actual_samples, random_state=42)
-        sampled_data[star_type] = sampled
-        logger.info(f"{star_type}型星：总数{len(type_data)}，抽取{actual_samples}条")
+    for i, star_type in enumerate(groups):
+        # 稳定排序保持组内原有的行顺序，抽样结果与逐组df.sample一致
+        rows = order[bounds[i]:bounds[i + 1]]
+        picked = rows[sample_positions(len(rows), n_samples, seed)]
+        logger.info(f"{star_type}型星：总数{len(rows)}，抽取{len(picked)}条")
+        sampled_data[star_type] = df.iloc[picked]
     
     # 合并所有抽样数据
     merged_data = pd.concat(list(sampled_data.values()), ignore_index=True)
     return sampled_data, merged_data
 
+def sample_group(type_data, star_type, n_samples=1000, seed=42):
+    """从一个类型的数据中随机抽取n_samples条"""
+    sampled = type_data.iloc[sample_positions(len(type_data), n_samples, seed)]
+    logger.info(f"{star_type}型星：总数{len(type_data)}，抽取{len(sampled)}条")
+    return sampled
+
+def sample_partitions(partitions, n_samples=1000, seed=42):
+    """从按光谱类型分区的参数表中抽样：每个类型只需读取自己的分区文件，不需要字符串比较。
+    subclass缺失的分区不参与抽样"""
+    sampled_data = {star_type: sample_group(type_data, star_type, n_samples, seed)
+                    for star_type, type_data in partitions if star_type != MISSING_PARTITION}
+    merged_data = pd.concat(list(sampled_data.values()), ignore_index=True)
+    return sampled_data, merged_data
+
+def obsid_hash(obsids, seed=42):
+    """以seed为密钥的obsid哈希（splitmix64混合），映射到[0, 1)。
+    结果只取决于obsid和密钥，与行的位置、星表的其他行都无关"""
+    key = np.uint64(int.from_bytes(hashlib.blake2b(str(seed).encode(), digest_size=8).digest(), 'little'))
+    x = np.asarray(obsids).astype(np.uint64) ^ key
+    x += np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+def lowest_per_group(codes, keys, quotas):
+    """按(分组, key)排序后取每组key最小的quotas[组]行，返回按原顺序排列的行位置"""
+    counts = np.bincount(codes, minlength=len(quotas))
+    order = np.lexsort((keys, codes))
+    starts = np.concatenate([[0], np.cumsum(counts)])[:-1]
+    rank = np.arange(len(order)) - starts[codes[order]]
+    return np.sort(order[rank < quotas[codes[order]]])
+
+def sample_by_hash(df, type_col, n_samples=1000, by='type', seed=42):
+    """按obsid哈希抽样：每个类型保留哈希值最小的n_samples行。
+    星表增加或减少行时，只有哈希值排在边界附近的少数obsid会进出样本"""
+    codes, groups = group_codes(df, type_col, by)
+    valid = np.flatnonzero(codes >= 0)
+    codes = codes[valid]
+    quotas = np.full(len(groups), n_samples)
+    picked = lowest_per_group(codes, obsid_hash(df['obsid'].to_numpy()[valid], seed), quotas)
+    rows = valid[picked]
+    codes = codes[picked]
+    counts = np.bincount(codes, minlength=len(groups))
+    sampled_data = {}
+    for i, star_type in enumerate(groups):
+        sampled_data[star_type] = df.iloc[rows[codes == i]]
+        logger.info(f"{star_type}型星：总数{counts[i]}，抽取{len(sampled_data[star_type])}条")
+    merged_data = pd.concat(list(sampled_data.values()), ignore_index=True)
+    return sampled_data, merged_data
+
+# 覆盖抽样默认使用的参数（标准化后计算距离），可以加入颜色等其他数值列
+COVERAGE_COLUMNS = ('teff', 'logg', 'feh')
+
+# 最远点采样中维护各块最大距离时的块大小
+FPS_BLOCK_SIZE = 1024
+
+def farthest_point_sample(points, n_samples, seed=42):
+    """贪心最远点采样（k-center的2近似）：每次选取离已选点最远的点。
+    新选的点只会缩短与它的距离小于当前最大距离的那些点的距离，用KD树的球查询只更新这些点；
+    最大值按块维护，每次只重新计算被更新的块。返回按选取顺序排列的行位置和最终的覆盖半径"""
+    n = len(points)
+    if n_samples >= n:
+        return np.arange(n), 0.0
+    tree = cKDTree(points)
+    first = int(np.random.default_rng(seed).integers(n))
+    dist = np.full(-(-n // FPS_BLOCK_SIZE) * FPS_BLOCK_SIZE, -1.0)
+    dist[:n] = np.linalg.norm(points - points[first], axis=1)
+    # 已选的点距离置为-1，不会再被选中
+    dist[first] = -1.0
+    blocks = dist.reshape(-1, FPS_BLOCK_SIZE)
+    block_max = blocks.max(axis=1)
+    selected = [first]
+    for _ in range(n_samples - 1):
+        b = int(block_max.argmax())
+        i = b * FPS_BLOCK_SIZE + int(blocks[b].argmax())
+        selected.append(i)
+        near = np.asarray(tree.query_ball_point(points[i], dist[i], return_sorted=False), dtype=np.intp)
+        d = np.linalg.norm(points[near] - points[i], axis=1)
+        closer = d < dist[near]
+        dist[near[closer]] = d[closer]
+        dist[i] = -1.0
+        touched = np.unique(np.append(near[closer], i) // FPS_BLOCK_SIZE)
+        block_max[touched] = blocks[touched].max(axis=1)
+    return np.asarray(selected), float(max(block_max.max(), 0.0))
+
+def sample_by_coverage(df, type_col, n_samples=1000, columns=COVERAGE_COLUMNS, by='type', seed=42):
+    """覆盖最大化抽样：参数按全表标准化后，在每个类型内做最远点采样，使样本均匀覆盖参数空间。
+    每个类型的样本按选取顺序排列，任意前k条本身也是较好的覆盖"""
+    columns = list(columns)
+    values = df[columns].to_numpy(dtype=np.float64)
+    valid = np.isfinite(values).all(axis=1)
+    if not valid.all():
+        logger.info(f"{np.count_nonzero(~valid)}条记录的参数缺失，不参与覆盖抽样")
+    points = (values - np.nanmean(values[valid], axis=0)) / np.nanstd(values[valid], axis=0)
+    codes, groups = group_codes(df, type_col, by)
+    sampled_data = {}
+    for i, star_type in enumerate(groups):
+        rows = np.flatnonzero(valid & (codes == i))
+        picked, radius = farthest_point_sample(points[rows], n_samples, seed)
+        sampled_data[star_type] = df.iloc[rows[picked]]
+        logger.info(f"{star_type}型星：总数{len(rows)}，抽取{len(picked)}条，覆盖半径{radius:.3f}（标准化单位）")
+    merged_data = pd.concat(list(sampled_data.values()), ignore_index=True)
+    return sampled_data, merged_data
+
+class StratifiedReservoir:
+    """分层水塘抽样：按块读入星表，每行得到一个由种子决定的均匀随机数，每层只保留随机数最小的
+    n_samples行，等价于在每层中无放回均匀抽样。内存只与抽样数和块大小有关，
+    同一种子下结果与分块大小无关。hashed为True时用obsid_hash代替随机数，结果与sample_by_hash相同"""
+
+    def __init__(self, n_samples=1000, type_col='subclass', by='type', seed=42, hashed=False):
+        self.n_samples = n_samples
+        self.type_col = type_col
+        self.by = by
+        self.seed = seed
+        self.hashed = hashed
+        self.rng = np.random.default_rng(seed)
+        # 层名 -> (随机数, 按星表顺序排列的行)
+        self.reservoirs = {}
+        self.totals = {}
+
+    def _threshold(self, group):
+        """层已满时，只有随机数小于当前水塘中最大随机数的行才可能进入水塘"""
+        keys, _ = self.reservoirs.get(group, (None, None))
+        if keys is None or len(keys) < self.n_samples:
+            return np.inf
+        return keys.max()
+
+    def update(self, chunk):
+        """加入一块数据"""
+        if self.hashed:
+            keys = obsid_hash(chunk['obsid'].to_numpy(), self.seed)
+        else:
+            keys = self.rng.random(len(chunk))
+        codes, groups = group_codes(chunk, self.type_col, self.by)
+        for group, count in zip(groups, np.bincount(codes[codes >= 0], minlength=len(groups))):
+            self.totals[group] = self.totals.get(group, 0) + int(count)
+        # 末尾多一个阈值0给编码为-1的行，它们不会成为候选
+        thresholds = np.array([self._threshold(group) for group in groups] + [0.0])
+        candidates = np.flatnonzero(keys < thresholds[codes])
+        order, bounds = group_slices(codes[candidates], len(groups))
+        for i, group in enumerate(groups):
+            rows = candidates[order[bounds[i]:bounds[i + 1]]]
+            if len(rows):
+                self._merge(group, keys[rows], chunk.iloc[rows])
+        return self
+
+    def _merge(self, group, keys, rows):
+        if group in self.reservoirs:
+            old_keys, old_rows = self.reservoirs[group]
+            keys = np.concatenate([old_keys, keys])
+            rows = pd.concat([old_rows, rows])
+        if len(keys) > self.n_samples:
+            # 保留随机数最小的n_samples行，排序后的位置仍按星表顺序
+            keep = np.sort(np.argpartition(keys, self.n_samples - 1)[:self.n_samples])
+            keys, rows = keys[keep], rows.iloc[keep]
+        self.reservoirs[group] = (keys, rows)
+
+    def result(self):
+        """返回每层的抽样数据和合并后的数据，分层按首次出现的顺序排列"""
+        sampled_data = {}
+        for group, total in self.totals.items():
+            sampled = self.reservoirs[group][1].reset_index(drop=True)
+            sampled_data[group] = sampled
+            logger.info(f"{group}型星：总数{total}，抽取{len(sampled)}条")
+        merged_data = pd.concat(list(sampled_data.values()), ignore_index=True)
+        return sampled_data, merged_data
+
+def reservoir_sample(chunks, type_col, n_samples=1000, by='type', seed=42, hashed=False):
+    """从逐块产出的DataFrame中分层水塘抽样，返回每种类型的数据和合并后的数据"""
+    reservoir = StratifiedReservoir(n_samples, type_col, by, seed, hashed)
+    for chunk in chunks:
+        reservoir.update(chunk)
+    return reservoir.result()
+
+# 参数网格分层抽样：默认的网格宽度和配额分配方式
+GRID_PARAMS = ('teff', 'logg', 'feh')
+DEFAULT_BIN_WIDTHS = {'teff': 500.0, 'logg': 0.5, 'feh': 0.25}
+QUOTA_SCHEMES = ('equal', 'proportional', 'sqrt')
+
+def split_groups(df, type_col, by='type'):
+    """把抽样结果按类型拆分，返回{类型: DataFrame}和合并后的数据，类型按首次出现的顺序排列"""
+    codes, groups = group_codes(df, type_col, by)
+    order, bounds = group_slices(codes, len(groups))
+    sampled_data = {group: df.iloc[order[bounds[i]:bounds[i + 1]]] for i, group in enumerate(groups)}
+    merged_data = pd.concat(list(sampled_data.values()), ignore_index=True)
+    return sampled_data, merged_data
+
+def grid_edges(values, width):
+    """覆盖values取值范围、对齐到width整数倍的网格边界"""
+    lo = np.floor(np.nanmin(values) / width) * width
+    hi = np.floor(np.nanmax(values) / width) * width + width
+    return np.arange(round((hi - lo) / width) + 1) * width + lo
+
+def allocate_quotas(counts, total, scheme='sqrt'):
+    """把total条样本分配给各网格：权重为equal（相同）、proportional（与行数成正比）
+    或sqrt（与行数的平方根成正比）。配额不超过网格的行数，多出的部分按权重分给其余网格，
+    取整时按余数从大到小补齐"""
+    counts = np.asarray(counts, dtype=np.int64)
+    weights = {'equal': (counts > 0).astype(float), 'proportional': counts.astype(float),
+               'sqrt': np.sqrt(counts)}[scheme]
+    quotas = np.zeros(len(counts), dtype=np.int64)
+    remaining = min(int(total), int(counts.sum()))
+    active = counts > 0
+    while remaining > 0 and active.any():
+        share = np.zeros(len(counts))
+        share[active] = remaining * weights[active] / weights[active].sum()
+        full = active & (share >= counts - quotas)
+        if full.any():
+            # 行数不够分的网格全部抽取，剩下的配额在其余网格中重新分配
+            remaining -= int((counts - quotas)[full].sum())
+            quotas[full] = counts[full]
+            active &= ~full
+            continue
+        base = np.floor(share).astype(np.int64)
+        extra = remaining - int(base.sum())
+        order = np.argsort(-(share - base), kind='stable')[:extra]
+        base[order] += 1
+        quotas += base
+        break
+    return quotas
+
+def sample_by_grid(df, type_col, n_total=3000, widths=None, scheme='sqrt', by='type', seed=42):
+    """按teff × logg × feh网格分层抽样：每行用digitize得到所在网格，bincount统计各网格行数，
+    按scheme分配配额后一次性抽取（按(网格, 随机数)排序后取每个网格的前若干行）。
+    返回每种类型的数据、合并后的数据和各网格的行数/配额/抽取数"""
+    widths = {**DEFAULT_BIN_WIDTHS, **(widths or {})}
+    values = {name: df[name].to_numpy(dtype=np.float64) for name in GRID_PARAMS}
+    valid = np.logical_and.reduce([np.isfinite(v) for v in values.values()])
+    if not valid.all():
+        logger.info(f"{np.count_nonzero(~valid)}条记录的参数缺失，不参与网格抽样")
+    # subclass缺失的行不属于任何类型，也不参与抽样
+    valid &= group_codes(df, type_col, by)[0] >= 0
+    edges = {name: grid_edges(values[name][valid], widths[name]) for name in GRID_PARAMS}
+    shape = tuple(len(e) - 1 for e in edges.values())
+    bins = np.ravel_multi_index(
+        [np.clip(np.digitize(values[name][valid], edges[name]) - 1, 0, len(edges[name]) - 2)
+         for name in GRID_PARAMS], shape)
+    counts = np.bincount(bins, minlength=int(np.prod(shape)))
+    quotas = allocate_quotas(counts, n_total, scheme)
+
+    # 每行一个随机数，按(网格, 随机数)排序后每个网格中排名小于配额的行入选
+    keys = np.random.default_rng(seed).random(len(bins))
+    picked = lowest_per_group(bins, keys, quotas)
+    rows = np.flatnonzero(valid)[picked]
+
+    occupied = np.flatnonzero(counts)
+    index = np.unravel_index(occupied, shape)
+    occupancy = pd.DataFrame({key: value for name, i in zip(GRID_PARAMS, index)
+                              for key, value in ((f'{name}_lo', edges[name][i]),
+                                                 (f'{name}_hi', edges[name][i + 1]))})
+    occupancy['count'] = counts[occupied]
+    occupancy['quota'] = quotas[occupied]
+    occupancy['sampled'] = np.bincount(bins[picked], minlength=len(counts))[occupied]
+    logger.info(f"非空网格{len(occupied)}个，抽样覆盖{np.count_nonzero(occupancy['sampled'])}个，"
+                f"共抽取{len(rows)}条")
+
+    sampled_data, merged_data = split_groups(df.iloc[rows], type_col, by)
+    for star_type, type_df in sampled_data.items():
+        logger.info(f"{star_type}型星：抽取{len(type_df)}条")
+    return sampled_data, merged_data, occupancy
+
+def parse_bin_width(text):
+    """解析 --bin-width 参数，例如 teff=250"""
+    name, sep, width = text.partition('=')
+    if not sep or name not in GRID_PARAMS:
+        raise argparse.ArgumentTypeError(f"格式应为 参数名=宽度，参数名为 {', '.join(GRID_PARAMS)} 之一：{text!r}")
+    try:
+        width = float(width)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的网格宽度：{text!r}")
+    if width <= 0:
+        raise argparse.ArgumentTypeError(f"网格宽度必须为正数：{text!r}")
+    return name, width
+
 def save_type_data(data_dict, base_dir):
     """保存每种类型的数据到单独的文件"""
     for star_type, df in data_dict.items():
@@ -38,9 +360,49 @@ def save_type_data(data_dict, base_dir):
         # 保存obsid列表
         obsid_file = base_dir / f'type_{star_type}_obsid.txt'
         df['obsid'].to_csv(obsid_file, index=False, header=False)
+        # 同时保存有序的二进制obsid集合，便于快速做集合运算；与上次的抽样结果比较变化
+        obsid_set_file = obsid_file.with_suffix('.npy')
+        previous = load_obsid_set(obsid_set_file) if obsid_set_file.exists() else None
+        current = save_obsid_set(df['obsid'], obsid_set_file)
+        if previous is not None:
+            logger.info(f"{star_type}型星与上次抽样相比：新增{len(current - previous)}个，"
+                        f"移除{len(previous - current)}个obsid")
         logger.info(f"{star_type}型星obsid列表已保存到: {obsid_file}")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='按光谱类型从AFG星表中抽样')
+    parser.add_argument('--group-by', choices=GROUP_BY, default='type',
+                        help='抽样分组：光谱类型（subclass首字母）或subclass（默认type）')
+    parser.add_argument('--n-samples', type=int, default=1000, help='每组抽取的条数（默认 1000）')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子，hash抽样时为哈希的密钥（默认 42）')
+    parser.add_argument('--dedup-radius', type=float, default=0,
+                        help='抽样前按位置合并重复观测（角秒），每颗星只保留SNR最高的观测；0表示不去重')
+    parser.add_argument('--method', choices=['random', 'hash', 'grid', 'coverage'], default='random',
+                        help='random：每组随机抽取 --n-samples 条；hash：每组保留obsid哈希值最小的 --n-samples 条，'
+                             '星表增长时样本基本不变；grid：按teff × logg × feh网格分层抽样；'
+                             'coverage：每组在标准化参数空间中做最远点采样（默认random）')
+    parser.add_argument('--total-samples', type=int, default=3000, help='grid抽样的总条数（默认 3000）')
+    parser.add_argument('--bin-width', type=parse_bin_width, action='append', default=[], metavar='NAME=WIDTH',
+                        help='grid抽样的网格宽度，可重复指定（默认 teff=500 logg=0.5 feh=0.25）')
+    parser.add_argument('--quota', choices=QUOTA_SCHEMES, default='sqrt',
+                        help='grid抽样各网格的配额：equal相同、proportional与行数成正比、'
+                             'sqrt与行数的平方根成正比（默认sqrt）')
+    parser.add_argument('--coverage-columns', nargs='+', default=list(COVERAGE_COLUMNS),
+                        help='coverage抽样使用的数值列（默认 teff logg feh，可加入颜色等列）')
+    parser.add_argument('--stream', action='store_true',
+                        help='分块读取参数表并做分层水塘抽样，内存只与抽样数和块大小有关（不能与 --dedup-radius 同时使用）')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'流式抽样时每块的行数（默认 {DEFAULT_CHUNK_SIZE}）')
+    args = parser.parse_args(argv)
+    if args.stream and args.dedup_radius > 0:
+        parser.error('--stream 不能与 --dedup-radius 同时使用')
+    if args.stream and args.method in ('grid', 'coverage'):
+        parser.error(f'--stream 不能与 --method {args.method} 同时使用')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
     # 设置路径
     base_dir = Path(__file__).parent.parent
     data_dir = base_dir / 'data'
@@ -51,13 +413,45 @@ def main():
     try:
         # 读取原始数据
         params_file = processed_dir / 'AFG_params.csv'
-        logger.info(f"Reading data from: {params_file}")
-        df = pd.read_csv(params_file)
-        logger.info(f"Total records: {len(df)}")
-        
-        # 进行抽样
-        logger.info("\n开始随机抽样...")
-        sampled_dict, merged_df = sample_by_type(df, 'subclass', n_samples=1000)
+        if args.stream:
+            logger.info("\n开始分层水塘抽样（分块读取）...")
+            sampled_dict, merged_df = reservoir_sample(iter_params(processed_dir, chunk_size=args.chunk_size),
+                                                       'subclass', args.n_samples, args.group_by, args.seed,
+                                                       hashed=args.method == 'hash')
+        elif (args.method == 'random' and args.group_by == 'type' and args.dedup_radius == 0
+                and load_manifest(processed_dir, 'type') is not None):
+            # 已有按光谱类型分区的参数表时逐个分区抽样
+            logger.info("\n开始随机抽样（按光谱类型分区读取）...")
+            sampled_dict, merged_df = sample_partitions(iter_partitions(processed_dir, by='type'),
+                                                        args.n_samples, args.seed)
+        else:
+            df = load_params(processed_dir)
+            logger.info(f"Total records: {len(df)}")
+            if args.dedup_radius > 0:
+                # 同一颗星的多次观测会使抽样偏向被重复观测的星
+                df = deduplicate(df, args.dedup_radius)
+            
+            # 进行抽样
+            if args.method == 'grid':
+                logger.info("\n开始按参数网格分层抽样...")
+                sampled_dict, merged_df, occupancy = sample_by_grid(
+                    df, 'subclass', args.total_samples, dict(args.bin_width), args.quota, args.group_by,
+                    args.seed)
+                occupancy_file = sample_dir / 'AFG_bin_occupancy.csv'
+                occupancy.to_csv(occupancy_file, index=False)
+                logger.info(f"网格占用报告已保存到: {occupancy_file}")
+            elif args.method == 'coverage':
+                logger.info("\n开始覆盖抽样（最远点采样）...")
+                sampled_dict, merged_df = sample_by_coverage(df, 'subclass', args.n_samples, args.coverage_columns,
+                                                             args.group_by, args.seed)
+            elif args.method == 'hash':
+                logger.info("\n开始按obsid哈希抽样...")
+                sampled_dict, merged_df = sample_by_hash(df, 'subclass', args.n_samples, args.group_by,
+                                                         args.seed)
+            else:
+                logger.info("\n开始随机抽样...")
+                sampled_dict, merged_df = sample_by_type(df, 'subclass', args.n_samples, args.group_by,
+                                                         args.seed)
         
         # 保存每种类型的数据
         logger.info("\n保存分类数据...")
@@ -70,14 +464,16 @@ def main():
         
         merged_obsid_file = sample_dir / 'AFG_merged_obsid.txt'
         merged_df['obsid'].to_csv(merged_obsid_file, index=False, header=False)
+        save_obsid_set(merged_df['obsid'], merged_obsid_file.with_suffix('.npy'))
         logger.info(f"合并的obsid列表已保存到: {merged_obsid_file}")
         
         # 显示每种类型的统计信息
         logger.info("\n各类型数据统计:")
+        type_stats = {}
         for star_type, type_df in sampled_dict.items():
             logger.info(f"\n{star_type}型星统计信息:")
-            stats = type_df[['teff', 'logg', 'feh', 'snrg']].describe()
-            logger.info("\n" + str(stats))
+            type_stats[star_type] = CatalogStats().update(type_df)
+            logger.info("\n" + str(type_stats[star_type].describe()))
         
         # 显示合并数据的统计信息
         logger.info("\n合并数据统计:")
@@ -87,8 +483,9 @@ def main():
             logger.info(f"{type_name}型星: {count}条")
         
         logger.info("\n基本参数统计:")
-        merged_stats = merged_df[['teff', 'logg', 'feh', 'snrg']].describe()
-        logger.info("\n" + str(merged_stats))
+        # 合并数据的统计量由各类型的统计量直接合并得到，无需重新计算
+        merged_stats = CatalogStats.combine(type_stats.values())
+        logger.info("\n" + str(merged_stats.describe()))
         
     except FileNotFoundError:
         logger.error(f"Error: Could not find file {params_file}")
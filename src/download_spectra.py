@@ -7,23 +7,32 @@ import logging
 from pylamost import lamost
 import pandas as pd
 
+from obsid_set import ObsidSet, load_obsid_set, read_obsid_list
+
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def read_obsid_file(file_path):
-    """读取obsid文件"""
-    return pd.read_csv(file_path, header=None)[0].tolist()
+    """读取obsid文件（每行一个obsid的文本文件或二进制.npy集合），保持文件中的顺序"""
+    return read_obsid_list(file_path)
 
 # def estimate_storage_size(num_spectra, avg_size_mb=2.5):
 #     """估算所需存储空间（MB）"""
 #     total_size_mb = num_spectra * avg_size_mb
 #     return total_size_mb
 
+# 每下载这么多个文件保存一次已下载的obsid集合，中断后最多重新下载这么多个
+SAVE_INTERVAL = 10
+
 def download_spectra(l, obsid_list, save_dir, type_name):
-    """下载指定类型的光谱数据"""
+    """下载指定类型的光谱数据。已下载成功的obsid定期并入save_dir下的集合文件，
+    中断（包括Ctrl-C）时也会保存，下次运行时跳过"""
+    downloaded_file = downloaded_obsids_file(save_dir, type_name)
+    downloaded = downloaded_obsids(save_dir, type_name)
     success_count = 0
     failed_count = 0
+    success_obsids = []
     failed_obsids = []
     
     # 创建类型特定的保存目录
@@ -33,26 +42,43 @@ def download_spectra(l, obsid_list, save_dir, type_name):
     total = len(obsid_list)
     logger.info(f"\n开始下载{type_name}型星光谱数据，共{total}个...")
     
-    for i, obsid in enumerate(obsid_list, 1):
-        try:
-            logger.info(f"正在下载 {type_name}型星 {i}/{total}: {obsid}")
-            l.downloadFits(obsid=str(obsid), savedir=str(type_dir))
-            success_count += 1
-        except Exception as e:
-            logger.error(f"下载失败 {obsid}: {str(e)}")
-            failed_count += 1
-            failed_obsids.append(obsid)
-            
-        # 每下载10个文件输出一次进度
-        if i % 10 == 0:
-            logger.info(f"当前进度: {i}/{total} ({(i/total*100):.2f}%)")
+    try:
+        for i, obsid in enumerate(obsid_list, 1):
+            try:
+                logger.info(f"正在下载 {type_name}型星 {i}/{total}: {obsid}")
+                l.downloadFits(obsid=str(obsid), savedir=str(type_dir))
+                success_count += 1
+                success_obsids.append(obsid)
+            except Exception as e:
+                logger.error(f"下载失败 {obsid}: {str(e)}")
+                failed_count += 1
+                failed_obsids.append(obsid)
+
+            # 每下载SAVE_INTERVAL个文件输出一次进度，并保存已下载的obsid
+            if i % SAVE_INTERVAL == 0:
+                logger.info(f"当前进度: {i}/{total} ({(i/total*100):.2f}%)")
+                downloaded.union(success_obsids).save(downloaded_file)
+    finally:
+        if success_obsids:
+            downloaded.union(success_obsids).save(downloaded_file)
     
     return {
         'success': success_count,
         'failed': failed_count,
+        'success_list': success_obsids,
         'failed_list': failed_obsids
     }
 
+def downloaded_obsids_file(spectra_dir, type_name):
+    return spectra_dir / f'type_{type_name}_downloaded_obsids.npy'
+
+def downloaded_obsids(spectra_dir, type_name):
+    """已下载成功的obsid集合（二进制.npy），不存在时为空集合"""
+    downloaded_file = downloaded_obsids_file(spectra_dir, type_name)
+    if not downloaded_file.exists():
+        return ObsidSet()
+    return load_obsid_set(downloaded_file)
+
 def main():
     # 设置路径
     base_dir = Path(__file__).parent.parent
@@ -72,9 +98,13 @@ def main():
         obsid_file = sampled_dir / f'type_{star_type}_obsid.txt'
         # 读取全部 obsid
         all_obsids_for_type = read_obsid_file(obsid_file)
-        type_obsids[star_type] = all_obsids_for_type
-        logger.info(f"{star_type}型星: 将下载 {len(all_obsids_for_type)} 个文件")
-        total_obsids_to_download += len(all_obsids_for_type)
+        # 跳过之前已经下载成功的obsid
+        downloaded = downloaded_obsids(spectra_dir, star_type)
+        remaining = all_obsids_for_type[~downloaded.contains(all_obsids_for_type)].tolist()
+        type_obsids[star_type] = remaining
+        n_done = len(all_obsids_for_type) - len(remaining)
+        logger.info(f"{star_type}型星: 共 {len(all_obsids_for_type)} 个，已下载 {n_done} 个，将下载 {len(remaining)} 个文件")
+        total_obsids_to_download += len(remaining)
     
     logger.info(f"\n本次运行总共需要下载 {total_obsids_to_download} 个光谱文件")
     
@@ -96,6 +126,7 @@ def main():
         logger.info(f"\n{star_type}型星:")
         logger.info(f"成功: {result['success']} 个")
         logger.info(f"失败: {result['failed']} 个")
+        logger.info(f"已下载的obsid已保存到: {downloaded_obsids_file(spectra_dir, star_type)}")
         if result['failed'] > 0:
             # 恢复原始失败文件名
             failed_file = spectra_dir / f'type_{star_type}_failed_obsids.txt' 
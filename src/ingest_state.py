@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+def replace_atomically(path, write):
+    """先写入临时文件再原子替换，避免中断时留下半个文件"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def file_fingerprint(path):
+    """文件指纹：大小和修改时间（纳秒）"""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def same_fingerprint(entry, fingerprint):
+    """记录中的大小和修改时间是否与当前文件一致"""
+    return bool(entry) and all(entry.get(k) == v for k, v in fingerprint.items())
+
+def content_hash(path, chunk_size=8 << 20):
+    """按块读取计算文件内容的blake2b哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_entry(path, sources):
+    """源文件的指纹和内容哈希；大小和修改时间与记录一致时直接复用记录的哈希，不再读文件"""
+    fingerprint = file_fingerprint(path)
+    entry = sources.get(str(Path(path).resolve()))
+    if same_fingerprint(entry, fingerprint) and 'hash' in entry:
+        return entry
+    return {**fingerprint, 'hash': content_hash(path)}
+
+def config_hash(config):
+    """筛选条件、输出列等处理配置的哈希"""
+    text = json.dumps(config, sort_keys=True, ensure_ascii=False, default=list)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+def cache_key(sources, config):
+    """缓存键：按给定顺序排列的各源文件(路径, 内容哈希) + 处理配置。
+    文件顺序决定重复obsid保留哪一条，检查点也按文件序号记录进度，所以顺序不同键也不同"""
+    return config_hash({'sources': [[path, entry['hash']] for path, entry in sources.items()],
+                        'config': config})
+
+def load_state(path):
+    """读取增量处理状态（各源文件的指纹），不存在时返回空字典"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+    replace_atomically(path, write)
+
+def load_obsid_index(path, mmap=False):
+    """读取已处理obsid的有序索引，不存在时返回空数组。mmap为True时以只读内存映射打开，不读入内存"""
+    path = Path(path)
+    if not path.exists():
+        return np.empty(0, dtype=np.int64)
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+def save_obsid_index(obsids, path):
+    """排序去重后保存obsid索引（已经有序去重的数组直接保存）"""
+    index = np.asarray(obsids, dtype=np.int64)
+    if len(index) > 1 and not (index[1:] > index[:-1]).all():
+        index = np.unique(index)
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.save(f, index)
+    replace_atomically(path, write)
+
+def merge_obsid_index(obsids, path, chunk_size=1 << 20):
+    """把有序去重的obsids并入磁盘上的有序obsid索引（不存在时新建）。
+    合并结果按块写入临时文件再替换，内存只取决于obsids和chunk_size，不随索引长度增长；
+    替换前打开的内存映射仍指向旧的索引"""
+    path = Path(path)
+    obsids = np.asarray(obsids, dtype=np.int64)
+    if not path.exists():
+        save_obsid_index(obsids, path)
+        return
+    index = np.load(path, mmap_mode='r')
+    new = obsids[~in_sorted(obsids, index)]
+    if len(new) == 0:
+        return
+    # new[i]插在index[pos[i]]之前，index[j]向后移动pos中不大于j的元素个数
+    pos = np.searchsorted(index, new)
+    def write(tmp_path):
+        merged = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int64, shape=(len(index) + len(new),))
+        merged[pos + np.arange(len(new))] = new
+        for start in range(0, len(index), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(index)))
+            merged[rows + np.searchsorted(pos, rows, side='right')] = index[start:start + chunk_size]
+        merged.flush()
+    replace_atomically(path, write)
+
+def in_sorted(values, sorted_index):
+    """向量化二分查找：判断values中每个元素是否在有序索引中"""
+    values = np.asarray(values)
+    if len(sorted_index) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_index, values)
+    pos = np.minimum(pos, len(sorted_index) - 1)
+    return sorted_index[pos] == values
@@ -0,0 +1,128 @@
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ingest_state import in_sorted, replace_atomically
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ObsidSet:
+    """有序去重的int64 obsid集合。保存为.npy（带dtype/shape头），可以内存映射读取；
+    成员判断和集合运算都用向量化的searchsorted实现，不需要哈希表"""
+
+    def __init__(self, ids=()):
+        self.ids = np.unique(np.asarray(ids, dtype=np.int64))
+
+    @classmethod
+    def from_sorted(cls, ids):
+        """直接使用已经有序去重的数组（不复制、不重新排序）"""
+        obj = cls.__new__(cls)
+        obj.ids = ids
+        return obj
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        ids = np.load(path, mmap_mode='r' if mmap else None)
+        if ids.dtype != np.int64 or ids.ndim != 1:
+            raise ValueError(f"{path} is not an int64 obsid set")
+        return cls.from_sorted(ids)
+
+    def save(self, path):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.asarray(self.ids))
+        replace_atomically(path, write)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, obsid):
+        return bool(self.contains([obsid])[0])
+
+    def __eq__(self, other):
+        return isinstance(other, ObsidSet) and np.array_equal(self.ids, other.ids)
+
+    def __repr__(self):
+        return f"ObsidSet({len(self)} ids)"
+
+    def contains(self, values):
+        """values中每个obsid是否在集合中（布尔数组）"""
+        return in_sorted(np.asarray(values, dtype=np.int64), self.ids)
+
+    def union(self, other):
+        """并集：只把对方集合中本集合没有的obsid按二分查找的位置插入"""
+        other = as_obsid_set(other)
+        new = other.ids[~self.contains(other.ids)]
+        return ObsidSet.from_sorted(np.insert(self.ids, np.searchsorted(self.ids, new), new))
+
+    def intersection(self, other):
+        other = as_obsid_set(other)
+        small, large = (self, other) if len(self) <= len(other) else (other, self)
+        return ObsidSet.from_sorted(small.ids[large.contains(small.ids)])
+
+    def difference(self, other):
+        other = as_obsid_set(other)
+        return ObsidSet.from_sorted(self.ids[~other.contains(self.ids)])
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+def as_obsid_set(ids):
+    return ids if isinstance(ids, ObsidSet) else ObsidSet(ids)
+
+def read_obsid_list(path):
+    """按文件中的顺序读取obsid：.npy为二进制集合，其他按每行一个obsid的文本文件读取"""
+    path = Path(path)
+    if path.suffix == '.npy':
+        return np.asarray(ObsidSet.load(path).ids)
+    return pd.read_csv(path, header=None, dtype=np.int64)[0].to_numpy()
+
+def load_obsid_set(path):
+    """读取obsid集合（二进制或文本格式）"""
+    path = Path(path)
+    if path.suffix == '.npy':
+        return ObsidSet.load(path)
+    return ObsidSet(read_obsid_list(path))
+
+def save_obsid_set(ids, path):
+    """保存obsid集合：.npy为二进制集合，其他写为每行一个obsid的文本文件"""
+    ids = as_obsid_set(ids)
+    path = Path(path)
+    if path.suffix == '.npy':
+        ids.save(path)
+    else:
+        pd.Series(np.asarray(ids.ids)).to_csv(path, index=False, header=False)
+    return ids
+
+SET_OPERATIONS = {
+    'union': ObsidSet.union,
+    'intersection': ObsidSet.intersection,
+    'difference': ObsidSet.difference,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='obsid列表的格式转换和集合运算')
+    parser.add_argument('operation', choices=['convert', *SET_OPERATIONS],
+                        help='convert：合并所有输入并转换格式；其余按顺序对所有输入做集合运算')
+    parser.add_argument('inputs', nargs='+', type=Path, help='obsid文件（.npy或每行一个obsid的文本文件）')
+    parser.add_argument('-o', '--output', type=Path, required=True, help='输出文件（.npy或文本）')
+    args = parser.parse_args(argv)
+
+    result = load_obsid_set(args.inputs[0])
+    for path in args.inputs[1:]:
+        operation = SET_OPERATIONS.get(args.operation, ObsidSet.union)
+        result = operation(result, load_obsid_set(path))
+    save_obsid_set(result, args.output)
+    logger.info(f"{args.operation}: {len(result)} 个obsid已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import logging
+from pathlib import Path
+
+import astropy.units as u
+import numpy as np
+from astropy_healpix import HEALPix
+
+from catalog_store import load_params
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认HEALPix分辨率：nside=64时像素约0.92度，与LAMOST单个视场（直径5度）相比足够细
+DEFAULT_NSIDE = 64
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    """球面角距离（度），使用haversine公式，小角度时数值稳定"""
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    a = (np.sin((dec2 - dec1) / 2) ** 2
+         + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2)
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+def expand_ranges(starts, stops):
+    """把若干[start, stop)区间向量化展开为下标"""
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64)
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+class SkyIndex:
+    """按HEALPix像素（nested编号）排序分区的天区索引。
+    rows为星表中的行号，pixels/ra/dec与rows一一对应并按像素排序，
+    同一像素的星连续存放，查询只需对候选像素做二分查找"""
+
+    def __init__(self, nside, pixels, rows, ra, dec):
+        self.nside = nside
+        self.healpix = HEALPix(nside=nside, order='nested')
+        self.pixels = pixels
+        self.rows = rows
+        self.ra = ra
+        self.dec = dec
+
+    @classmethod
+    def build(cls, ra, dec, nside=DEFAULT_NSIDE):
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        pixels = HEALPix(nside=nside, order='nested').lonlat_to_healpix(ra * u.deg, dec * u.deg)
+        order = np.argsort(pixels, kind='stable')
+        return cls(nside, pixels[order], order.astype(np.int64), ra[order], dec[order])
+
+    def save(self, path):
+        np.savez(path, nside=self.nside, pixels=self.pixels, rows=self.rows, ra=self.ra, dec=self.dec)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(int(f['nside']), f['pixels'], f['rows'], f['ra'], f['dec'])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def pixel_of(self, ra, dec):
+        """坐标所在的HEALPix像素"""
+        return self.healpix.lonlat_to_healpix(np.asarray(ra) * u.deg, np.asarray(dec) * u.deg)
+
+    def positions_in_pixels(self, pixels):
+        """给定像素内所有星在索引中的位置（按像素排序后的下标）"""
+        pixels = np.unique(np.asarray(pixels, dtype=np.int64))
+        starts = np.searchsorted(self.pixels, pixels, side='left')
+        stops = np.searchsorted(self.pixels, pixels, side='right')
+        keep = stops > starts
+        starts, stops = starts[keep], stops[keep]
+        return expand_ranges(starts, stops)
+
+    def rows_in_pixels(self, pixels):
+        """给定像素内所有星在星表中的行号"""
+        return np.sort(self.rows[self.positions_in_pixels(pixels)])
+
+    def cone(self, ra, dec, radius):
+        """锥形查询：返回与(ra, dec)角距离不超过radius（度）的星的行号"""
+        positions = self.positions_in_pixels(self._cone_pixels(ra, dec, radius))
+        inside = angular_distance(ra, dec, self.ra[positions], self.dec[positions]) <= radius
+        return np.sort(self.rows[positions[inside]])
+
+    def box(self, ra_min, ra_max, dec_min, dec_max):
+        """矩形查询：ra在[ra_min, ra_max]（ra_min > ra_max时跨越0度）且dec在[dec_min, dec_max]内的星的行号"""
+        pixels = self._box_pixels(ra_min, ra_max, dec_min, dec_max)
+        positions = self.positions_in_pixels(pixels)
+        ra, dec = self.ra[positions], self.dec[positions]
+        if ra_min <= ra_max:
+            in_ra = (ra >= ra_min) & (ra <= ra_max)
+        else:
+            in_ra = (ra >= ra_min) | (ra <= ra_max)
+        inside = in_ra & (dec >= dec_min) & (dec <= dec_max)
+        return np.sort(self.rows[positions[inside]])
+
+    def _cone_pixels(self, ra, dec, radius):
+        """与球冠可能相交的像素。cone_search_lonlat按像素中心判断，
+        半径外扩两个像素尺寸后才能包含中心在球冠外、但部分落在球冠内的像素"""
+        margin = 2 * self.healpix.pixel_resolution.to_value(u.deg)
+        return self.healpix.cone_search_lonlat(ra * u.deg, dec * u.deg, min(radius + margin, 180.0) * u.deg)
+
+    def _ring_pixels(self, dec_min, dec_max):
+        """中心dec落在[dec_min, dec_max]内的各环上的全部像素（nested编号）。
+        RING编号中每个环是连续的一段，只需按环中心纬度选出环再展开，不涉及dec带以外的像素"""
+        nside = self.nside
+        ring = np.arange(1, 4 * nside)
+        # 各环的像素数和中心的z = sin(dec)：北极冠、赤道带、南极冠
+        north = ring < nside
+        south = ring > 3 * nside
+        counts = np.where(north, 4 * ring, np.where(south, 4 * (4 * nside - ring), 4 * nside))
+        z = np.where(north, 1 - ring ** 2 / (3 * nside ** 2),
+                     np.where(south, (4 * nside - ring) ** 2 / (3 * nside ** 2) - 1,
+                              4 / 3 - 2 * ring / (3 * nside)))
+        ring_dec = np.degrees(np.arcsin(z))
+        starts = np.cumsum(counts) - counts
+        keep = (ring_dec >= dec_min) & (ring_dec <= dec_max)
+        return self.healpix.ring_to_nested(expand_ranges(starts[keep], starts[keep] + counts[keep]))
+
+    def _box_pixels(self, ra_min, ra_max, dec_min, dec_max):
+        """与矩形可能相交的像素：像素中心落在按像素尺寸外扩后的矩形内。
+        只对外扩后dec带内各环的像素计算中心坐标，耗时与dec带的面积成正比"""
+        margin = 2 * self.healpix.pixel_resolution.to_value(u.deg)
+        pixels = self._ring_pixels(dec_min - margin, dec_max + margin)
+        lon, _ = self.healpix.healpix_to_lonlat(pixels)
+        lon = lon.to_value(u.deg)
+        max_abs_dec = min(max(abs(dec_min), abs(dec_max)) + margin, 90)
+        if max_abs_dec < 90:
+            ra_margin = margin / np.cos(np.radians(max_abs_dec))
+            # 相对ra_min的偏移量，统一处理跨越0度的情况
+            width = ra_max - ra_min if ra_min <= ra_max else ra_max - ra_min + 360
+            offset = (lon - ra_min + ra_margin) % 360
+            if width + 2 * ra_margin < 360:
+                pixels = pixels[offset <= width + 2 * ra_margin]
+        return pixels
+
+def build_sky_index(ra, dec, path, nside=DEFAULT_NSIDE):
+    """构建并保存天区索引"""
+    index = SkyIndex.build(ra, dec, nside)
+    index.save(path)
+    logger.info(f"天区索引（HEALPix nside={nside}，{len(index)}颗星）已保存到: {path}")
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description='在处理后的AFG星表中按天区查询')
+    parser.add_argument('--processed-dir', type=Path, default=None,
+                        help='处理后数据目录（默认 data/processed）')
+    parser.add_argument('--output', type=Path, default=None, help='把查询结果保存为CSV')
+    sub = parser.add_subparsers(dest='query', required=True)
+    cone = sub.add_parser('cone', help='锥形查询')
+    cone.add_argument('ra', type=float)
+    cone.add_argument('dec', type=float)
+    cone.add_argument('radius', type=float, help='半径（度）')
+    box = sub.add_parser('box', help='矩形查询')
+    for name in ('ra_min', 'ra_max', 'dec_min', 'dec_max'):
+        box.add_argument(name, type=float)
+    args = parser.parse_args()
+
+    processed_dir = args.processed_dir or Path(__file__).parent.parent / 'data' / 'processed'
+    index = SkyIndex.load(processed_dir / 'AFG_healpix_index.npz')
+    if args.query == 'cone':
+        rows = index.cone(args.ra, args.dec, args.radius)
+    else:
+        rows = index.box(args.ra_min, args.ra_max, args.dec_min, args.dec_max)
+    logger.info(f"查询到 {len(rows)} 颗星")
+    if args.output is not None:
+        load_params(processed_dir).iloc[rows].to_csv(args.output, index=False)
+        logger.info(f"查询结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 import os
 
+from catalog_store import load_manifest, load_params, load_partitions
+
 # 设置绘图样式
 plt.style.use('seaborn-v0_8-darkgrid')
 sns.set_context("paper", font_scale=1.2)
@@ -17,9 +18,12 @@ os.makedirs(figures_dir, exist_ok=True)
 
 try:
     # 读取数据
-    data_path = os.path.join(data_dir, 'processed', 'AFG_stars.csv')
-    print(f"Reading data file: {data_path}")
-    df = pd.read_csv(data_path)
+    processed_dir = os.path.join(data_dir, 'processed')
+    if load_manifest(processed_dir, 'type') is not None:
+        # 按光谱类型分区读取，分区键直接作为spectral_type列
+        df = load_partitions(processed_dir, by='type', key_column='spectral_type')
+    else:
+        df = load_params(processed_dir)
     print("Data file loaded successfully")
 
     # 创建一个函数来保存图片
@@ -39,7 +43,8 @@ try:
 
     # 2. 不同光谱类型的温度箱线图
     plt.figure(figsize=(12, 6))
-    df['spectral_type'] = df['subclass'].str[0]
+    if 'spectral_type' not in df:
+        df['spectral_type'] = df['subclass'].str[0]
     sns.boxplot(data=df, x='spectral_type', y='teff')
     plt.title('Temperature Distribution by Spectral Type')
     plt.xlabel('Spectral Type')
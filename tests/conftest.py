@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# src/下的脚本按模块名互相导入
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
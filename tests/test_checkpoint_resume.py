@@ -0,0 +1,55 @@
+"""可恢复处理（--checkpoint）的中断和恢复检查。
+
+两个合成星表的obsid部分重复：文件顺序决定重复的obsid保留哪一条，
+所以改变 --fits 的顺序后不能沿用旧的检查点和缓存"""
+import pytest
+
+import data_read
+from benchmark_ingest import make_catalog
+
+@pytest.fixture(scope='module')
+def catalogs(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('catalogs')
+    # 同一行号的obsid在两个种子下约有一半相同，b另有1000行a中没有
+    return (make_catalog(directory / 'a.fits', 3000, seed=0),
+            make_catalog(directory / 'b.fits', 4000, seed=1))
+
+def ingest(paths, output_dir, *extra):
+    data_read.main(['--fits', *map(str, paths), '--output-dir', str(output_dir), '--format', 'csv',
+                    '--nside', '0', '--partition-by', 'none', '--block-size', '1000', *extra])
+    return (output_dir / 'AFG_params.csv').read_text()
+
+def interrupt_at(monkeypatch, fits_path):
+    """读到fits_path时模拟中断（此前各文件的块都已提交到检查点）"""
+    original = data_read._filtered_blocks
+    def filtered_blocks(path, *args, **kwargs):
+        if path == fits_path:
+            raise RuntimeError('simulated interruption')
+        return original(path, *args, **kwargs)
+    monkeypatch.setattr(data_read, '_filtered_blocks', filtered_blocks)
+
+def test_resume_same_order(catalogs, tmp_path, monkeypatch):
+    a, b = catalogs
+    expected = ingest([a, b], tmp_path / 'fresh', '--stream')
+    with monkeypatch.context() as m:
+        interrupt_at(m, b)
+        with pytest.raises(RuntimeError):
+            ingest([a, b], tmp_path / 'out', '--checkpoint')
+    assert (tmp_path / 'out' / 'AFG_ingest_checkpoint.json').exists()
+    assert ingest([a, b], tmp_path / 'out', '--checkpoint') == expected
+
+def test_resume_reordered(catalogs, tmp_path, monkeypatch):
+    """中断后换了文件顺序再运行，应丢弃旧的检查点，结果与按新顺序直接处理相同"""
+    a, b = catalogs
+    expected = ingest([b, a], tmp_path / 'fresh', '--stream')
+    assert expected != ingest([a, b], tmp_path / 'other', '--stream')
+    with monkeypatch.context() as m:
+        interrupt_at(m, b)
+        with pytest.raises(RuntimeError):
+            ingest([a, b], tmp_path / 'out', '--checkpoint')
+    assert ingest([b, a], tmp_path / 'out', '--checkpoint') == expected
+
+def test_cache_key_depends_on_order(catalogs, tmp_path):
+    a, b = catalogs
+    ingest([a, b], tmp_path / 'out')
+    assert ingest([b, a], tmp_path / 'out') == ingest([b, a], tmp_path / 'fresh')